@@ -0,0 +1,65 @@
+import difflib
+from comfy.graph_utils import GraphBuilder, is_link
+from comfy.graph import DynamicPrompt
+from .catalog import NodeCatalog
+from .validation import BAD_OUTPUT_INDEX, MISSING_INPUT, TYPE_MISMATCH, UNKNOWN_INPUT, GraphError, get_link_source_class, validate_graph
+
+# How similar a misspelled input name must be to a real one to be renamed
+RENAME_CUTOFF = 0.8
+
+def rename_input(graph: GraphBuilder, error: GraphError, catalog: NodeCatalog):
+    node = graph.nodes[error.node_id]
+    schema = catalog.schemas[node.class_type]
+    candidates = [k for k in schema.inputs if k not in node.inputs]
+    matches = difflib.get_close_matches(error.input_name, candidates, n=1, cutoff=RENAME_CUTOFF)
+    if len(matches) == 0:
+        return None
+    node.inputs[matches[0]] = node.inputs.pop(error.input_name)
+    return f"Renamed input '{error.input_name}' to '{matches[0]}' on node of type '{node.class_type}'"
+
+def fill_default(graph: GraphBuilder, error: GraphError, catalog: NodeCatalog):
+    node = graph.nodes[error.node_id]
+    schema = catalog.schemas[node.class_type]
+    if error.input_name in node.inputs or error.input_name not in schema.defaults:
+        return None
+    node.inputs[error.input_name] = schema.defaults[error.input_name]
+    return f"Set missing input '{error.input_name}' on node of type '{node.class_type}' to its default {schema.defaults[error.input_name]!r}"
+
+def fix_output_index(graph: GraphBuilder, existing_graph: DynamicPrompt, error: GraphError, catalog: NodeCatalog):
+    node = graph.nodes[error.node_id]
+    link = node.inputs.get(error.input_name)
+    if not is_link(link):
+        return None
+    from_id, idx = link
+    from_class_type = get_link_source_class(graph, existing_graph, from_id)
+    from_outputs = catalog.return_types.get(from_class_type)
+    if from_outputs is None:
+        return None
+    input_type = catalog.schemas[node.class_type].inputs[error.input_name][0]
+    matches = [i for i, output in enumerate(from_outputs) if not (output != input_type)]
+    if len(matches) != 1:
+        return None
+    node.inputs[error.input_name] = [from_id, matches[0]]
+    return f"Changed the {error.input_name} input of node of type '{node.class_type}' to use output {matches[0]} instead of {idx} from node of type '{from_class_type}'"
+
+def auto_repair(graph: GraphBuilder, existing_graph: DynamicPrompt, graph_errors: list[GraphError], catalog: NodeCatalog):
+    """
+    Applies fixes that can be made without asking the model: renaming misspelled inputs, filling
+    missing inputs that declare a default, and pointing links at the only output of the expected
+    type. The graph is modified in place. Returns the descriptions of the fixes applied and the
+    errors that remain after re-validating.
+    """
+    fixes = []
+    # Renames go first since they can also resolve missing-input errors
+    for error in graph_errors:
+        if error.kind == UNKNOWN_INPUT:
+            fixes.append(rename_input(graph, error, catalog))
+    for error in graph_errors:
+        if error.kind == MISSING_INPUT:
+            fixes.append(fill_default(graph, error, catalog))
+        elif error.kind in (BAD_OUTPUT_INDEX, TYPE_MISMATCH):
+            fixes.append(fix_output_index(graph, existing_graph, error, catalog))
+    fixes = [fix for fix in fixes if fix is not None]
+    if len(fixes) == 0:
+        return fixes, graph_errors
+    return fixes, validate_graph(graph, existing_graph, catalog)
@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+import types
+from .cache import fingerprint
+
+RECORD = "record"
+REPLAY = "replay"
+
+def make_completion(contents):
+    """Builds an object shaped like an OpenAI chat completion from a list of choice contents."""
+    return types.SimpleNamespace(choices=[
+        types.SimpleNamespace(
+            index=i,
+            message=types.SimpleNamespace(role="assistant", content=content),
+            finish_reason="stop",
+        )
+        for i, content in enumerate(contents)
+    ])
+
+def make_chunk(content):
+    return types.SimpleNamespace(choices=[
+        types.SimpleNamespace(index=0, delta=types.SimpleNamespace(content=content), finish_reason=None),
+    ])
+
+class ReplayStream:
+    def __init__(self, content, chunk_size=16):
+        self.content = content
+        self.chunk_size = chunk_size
+        self.closed = False
+
+    def __iter__(self):
+        for i in range(0, len(self.content), self.chunk_size):
+            if self.closed:
+                return
+            yield make_chunk(self.content[i:i + self.chunk_size])
+
+    def close(self):
+        self.closed = True
+
+class RecordingStream:
+    def __init__(self, stream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+        self.text = ""
+
+    def __iter__(self):
+        for chunk in self.stream:
+            if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+                self.text += chunk.choices[0].delta.content
+            yield chunk
+
+    def close(self):
+        self.stream.close()
+        self.on_close(self.text)
+
+def get_transcript_key(params):
+    # Streaming and non-streaming requests for the same prompt share a recording
+    return fingerprint({k: v for k, v in params.items() if k != "stream"})
+
+class RecordReplayBackend:
+    """
+    Completion backend that records the responses of another backend to a JSON transcript, or
+    replays a previously recorded transcript without touching the network. Requests are matched
+    on their exact parameters, so replaying requires the same prompt that was recorded.
+    """
+    def __init__(self, path, mode=REPLAY, inner=None):
+        if mode == RECORD and inner is None:
+            raise ValueError("Recording requires an inner backend")
+        self.path = path
+        self.mode = mode
+        self.inner = inner
+        self.lock = threading.Lock()
+        self.transcripts = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.transcripts = json.load(f)
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    def create(self, **params):
+        key = get_transcript_key(params)
+        if self.mode == REPLAY:
+            entry = self.transcripts.get(key)
+            if entry is None:
+                raise KeyError(f"No recorded completion for this request in {self.path}")
+            if params.get("stream", False):
+                return ReplayStream(entry["choices"][0])
+            return make_completion(entry["choices"])
+        response = self.inner.chat.completions.create(**params)
+        if params.get("stream", False):
+            return RecordingStream(response, lambda text: self.record(key, params, [text]))
+        self.record(key, params, [choice.message.content for choice in response.choices])
+        return response
+
+    def record(self, key, params, choices):
+        with self.lock:
+            self.transcripts[key] = {
+                "model": params.get("model"),
+                "messages": params.get("messages"),
+                "choices": choices,
+            }
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.transcripts, f, indent=1)
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,42 @@
+import re
+
+# Instructions given to the batch node are separated by lines containing only dashes
+separator_regex = re.compile(r"^\s*-{3,}\s*$", re.MULTILINE)
+code_block_regex = re.compile(r"```[^\n]*\n(.*?)```", re.DOTALL)
+graph_header_regex = re.compile(r"^\s*#\s*Graph\s+(\d+)\s*$", re.MULTILINE)
+
+BATCH_FORMAT = "Write a separate program for each numbered instruction. Each program builds its own graph using g and sets its own result['outputs']. All programs together must not return more than {max_outputs} outputs, so only return the outputs each instruction asks for. Respond with one ```python code block per instruction, in order, and start each code block with the line `# Graph N` where N is the number of the instruction."
+
+def split_instructions(text):
+    return [part.strip() for part in separator_regex.split(text) if len(part.strip()) > 0]
+
+def get_batch_instructions(instructions, failures):
+    """
+    Numbers the instructions for a single request. `failures` maps positions in `instructions` to
+    (code, feedback) pairs from an earlier attempt, which are included so the model can fix them.
+    The code is None if the response had no code block for the instruction.
+    """
+    lines = ["Complete each of the following instructions."]
+    for i, instruction in enumerate(instructions):
+        lines.append(f"{i + 1}. {instruction}")
+        if i in failures:
+            code, feedback = failures[i]
+            if code is not None:
+                lines.append(f"Your previous code for instruction {i + 1} was:\n```python\n{code}\n```")
+            lines.append(feedback)
+    return "\n".join(lines)
+
+def split_batch_response(text, count):
+    """Returns the code for each of the `count` instructions, or None where a block is missing."""
+    codes = [None] * count
+    position = 0
+    for block in code_block_regex.findall(text):
+        header = graph_header_regex.search(block)
+        if header is not None and 1 <= int(header.group(1)) <= count:
+            position = int(header.group(1)) - 1
+            # Numbers change between attempts, so don't keep them in the code
+            block = block[:header.start()] + block[header.end():].lstrip("\n")
+        if position < count and codes[position] is None:
+            codes[position] = block
+        position += 1
+    return codes
@@ -0,0 +1,134 @@
+"""
+Times each phase of AbracadabraNode.do_magic, then runs it end to end serially and concurrently.
+By default completions come from a local stub server, so no network access or API key is needed.
+Pass --live to use the OpenAI API instead, --record to save the completions to a transcript, and
+--replay to play a recorded transcript back.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from common import load_package, print_table, timeit
+from stub_server import start_stub_server
+
+abracadabra = load_package()
+from comfy.graph import DynamicPrompt
+from abracadabra import nodes as abra_nodes
+from abracadabra.backends import RECORD, REPLAY, RecordReplayBackend
+from abracadabra.static_graph import build_static_graph
+from abracadabra.streaming import extract_code
+from abracadabra.validation import validate_graph
+
+SCENARIOS = [
+    (
+        "text to image",
+        "Generate a 512x512 image of a cat playing a piano",
+        {},
+        {},
+    ),
+    (
+        "linked inputs",
+        "Generate two images of cats on skateboards. Avoid having humans in the images.",
+        {"1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sd-v1-5-inpainting.ckpt"}}},
+        {"input1": ["1", 0], "input2": ["1", 1], "input3": ["1", 2]},
+    ),
+]
+
+def time_phases(name, instructions, prompt, kwargs):
+    dynprompt = DynamicPrompt(prompt)
+    client = abra_nodes.completion_backend
+    timings = {}
+
+    def catalog_build():
+        abra_nodes.node_catalog.invalidate()
+        return abra_nodes.get_node_summaries()
+    timings["catalog build"] = timeit(catalog_build)
+    node_summaries = abra_nodes.get_node_summaries()
+
+    input_types, input_names = abra_nodes.get_input_signature(dynprompt, kwargs)
+    def example_loading():
+        abra_nodes.example_index.invalidate()
+        return abra_nodes.example_index.select(instructions, input_types)
+    timings["example loading"] = timeit(example_loading)
+    examples = abra_nodes.example_index.select(instructions, input_types)
+
+    timings["prompt assembly"] = timeit(lambda: abra_nodes.build_messages(instructions, input_types, input_names, examples, node_summaries))
+    messages = abra_nodes.build_messages(instructions, input_types, input_names, examples, node_summaries)
+
+    start = time.perf_counter()
+    completion = client.chat.completions.create(model=abra_nodes.MODEL, messages=messages)
+    timings["completion"] = time.perf_counter() - start
+    code = extract_code(completion.choices[0].message.content)
+
+    # Time whichever way do_magic turns the code into a graph
+    if abra_nodes.ENABLE_STATIC_GRAPH:
+        timings["compile/exec"] = timeit(lambda: build_static_graph(code, 0, kwargs))
+        builder = build_static_graph(code, 0, kwargs)[0]
+    else:
+        timings["compile/exec"] = timeit(lambda: abra_nodes.build_graph(code, 0, kwargs))
+        builder, _ = abra_nodes.build_graph(code, 0, kwargs)
+    timings["validation"] = timeit(lambda: validate_graph(builder, dynprompt, abra_nodes.node_catalog))
+    timings["finalize"] = timeit(builder.finalize)
+    return timings
+
+def run_end_to_end(scenario, count, workers):
+    _, instructions, prompt, kwargs = scenario
+    node = abra_nodes.AbracadabraNode()
+    failures = 0
+    def run(seed):
+        return node.do_magic(instructions, seed, DynamicPrompt(prompt), **kwargs)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run, seed) for seed in range(count)]
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                failures += 1
+    elapsed = time.perf_counter() - start
+    return elapsed, failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub server latency in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of stub requests that fail")
+    parser.add_argument("--count", type=int, default=20, help="Runs per end-to-end scenario")
+    parser.add_argument("--workers", type=int, default=8, help="Threads for the concurrent scenario")
+    parser.add_argument("--live", action="store_true", help="Use the real OpenAI API instead of the stub server")
+    parser.add_argument("--record", help="Record completions to this transcript")
+    parser.add_argument("--replay", help="Replay completions from this transcript instead of using the stub server")
+    parser.add_argument("--metrics-file", help="Write the collected metrics here (.prom for Prometheus text, otherwise JSON)")
+    args = parser.parse_args()
+
+    if args.replay:
+        abra_nodes.completion_backend = RecordReplayBackend(args.replay, REPLAY)
+    else:
+        if not args.live:
+            _, base_url = start_stub_server(latency=args.latency, failure_rate=args.failure_rate)
+            os.environ["OPENAI_BASE_URL"] = base_url
+            os.environ.setdefault("OPENAI_API_KEY", "stub")
+        if args.record:
+            abra_nodes.completion_backend = RecordReplayBackend(args.record, RECORD, abra_nodes.completion_backend)
+    # Every run should pay for generation
+    abra_nodes.ENABLE_GRAPH_CACHE = False
+    abra_nodes.ENABLE_SEMANTIC_CACHE = False
+
+    for scenario in SCENARIOS:
+        name = scenario[0]
+        timings = time_phases(*scenario)
+        print(f"\n== {name}: per-phase timings ==")
+        print_table(["phase", "ms"], [(phase, f"{seconds * 1000:.3f}") for phase, seconds in timings.items()])
+
+        rows = []
+        for mode, workers in (("serial", 1), ("concurrent", args.workers)):
+            elapsed, failures = run_end_to_end(scenario, args.count, workers)
+            rows.append((mode, workers, args.count, failures, f"{elapsed / args.count * 1000:.1f}", f"{args.count / elapsed:.2f}"))
+        print(f"\n== {name}: end to end ==")
+        print_table(["mode", "workers", "runs", "failures", "ms/run", "runs/s"], rows)
+
+    print("\nScheduler:", abracadabra.client_pool.scheduler.stats())
+    if args.metrics_file:
+        abracadabra.metrics.metrics.write(args.metrics_file)
+
+if __name__ == "__main__":
+    main()
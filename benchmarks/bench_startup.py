@@ -0,0 +1,80 @@
+"""
+Measures what loading the package costs ComfyUI at startup, and the latency of the first
+generation with and without the background warm-up. Each measurement runs in a fresh interpreter
+so that nothing is already imported or cached. Completions come from a local stub server.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+def measure_import():
+    from common import load_package
+    start = time.perf_counter()
+    load_package()
+    elapsed = time.perf_counter() - start
+    openai_loaded = "openai" in sys.modules
+    start = time.perf_counter()
+    import openai
+    return {"import": elapsed, "openai_loaded": openai_loaded, "openai_import": time.perf_counter() - start}
+
+def measure_first_call(warm):
+    from common import load_package
+    from stub_server import start_stub_server
+    _, base_url = start_stub_server()
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    load_package()
+    from comfy.graph import DynamicPrompt
+    from abracadabra import nodes as abra_nodes
+    abra_nodes.ENABLE_GRAPH_CACHE = False
+    abra_nodes.ENABLE_SEMANTIC_CACHE = False
+    if warm:
+        # What the background thread will have done by the time the first prompt runs
+        abra_nodes.WARM_UP_DELAY = 0
+        abra_nodes.warm_up()
+    start = time.perf_counter()
+    abra_nodes.AbracadabraNode().do_magic("Generate a 512x512 image of a cat playing a piano", 0, DynamicPrompt({}))
+    return {"first_call": time.perf_counter() - start}
+
+def run_child(mode):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode],
+        check=True,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONPATH": os.path.dirname(os.path.abspath(__file__))},
+    ).stdout
+    return json.loads(output.strip().split("\n")[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", choices=["import", "cold", "warm"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == "import":
+        print(json.dumps(measure_import()))
+        return
+    if args.child is not None:
+        print(json.dumps(measure_first_call(args.child == "warm")))
+        return
+
+    from common import print_table
+    imports = [run_child("import") for _ in range(args.runs)]
+    cold = [run_child("cold")["first_call"] for _ in range(args.runs)]
+    warm = [run_child("warm")["first_call"] for _ in range(args.runs)]
+    def ms(values):
+        return f"{statistics.median(values) * 1000:.1f}"
+    print_table(["measurement", "median ms"], [
+        ("package import", ms([x["import"] for x in imports])),
+        ("openai import (deferred)" if not imports[0]["openai_loaded"] else "openai import (already loaded)", ms([x["openai_import"] for x in imports])),
+        ("first call, cold", ms(cold)),
+        ("first call, after warm-up", ms(warm)),
+    ])
+
+if __name__ == "__main__":
+    main()
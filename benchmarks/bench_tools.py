@@ -0,0 +1,59 @@
+"""Micro-benchmarks for SmartType comparisons and VariantSupport's INPUT_TYPES and VALIDATE_INPUTS."""
+from common import load_module, print_table, timeit
+
+tools = load_module("tools.py")
+
+class BaselineSmartType(str):
+    """The original implementation, which splits both strings on every comparison."""
+    def __ne__(self, other):
+        if self == "*" or other == "*":
+            return False
+        selfset = set(self.split(','))
+        otherset = set(other.split(','))
+        return not selfset.issubset(otherset)
+
+PAIRS = [
+    ("IMAGE", "IMAGE"),
+    ("IMAGE", "MASK"),
+    ("IMAGE,MASK", "IMAGE,MASK,LATENT"),
+    ("*", "CONDITIONING"),
+]
+NUM_INPUTS = 20
+
+def make_node_class():
+    @tools.VariantSupport()
+    class Node:
+        @classmethod
+        def INPUT_TYPES(cls):
+            return {
+                "required": {f"input{i}": ("IMAGE,MASK", {}) for i in range(NUM_INPUTS)},
+                "optional": {f"extra{i}": ("*", {}) for i in range(NUM_INPUTS)},
+            }
+        RETURN_TYPES = ("IMAGE",)
+    return Node
+
+def main():
+    rows = []
+    for a, b in PAIRS:
+        baseline_a, baseline_b = BaselineSmartType(a), BaselineSmartType(b)
+        smart_a, smart_b = tools.SmartType(a), tools.SmartType(b)
+        baseline = timeit(lambda: baseline_a != baseline_b, number=100000)
+        smart = timeit(lambda: smart_a != smart_b, number=100000)
+        rows.append((f"{a} != {b}", f"{baseline * 1e9:.0f}", f"{smart * 1e9:.0f}", f"{baseline / smart:.1f}x"))
+    print_table(["comparison", "baseline ns", "SmartType ns", "speedup"], rows)
+    print()
+
+    node = make_node_class()
+    input_types = {f"input{i}": "IMAGE" for i in range(NUM_INPUTS)}
+    rows = [
+        ("INPUT_TYPES", f"{timeit(node.INPUT_TYPES, number=10000) * 1e6:.2f}"),
+        ("VALIDATE_INPUTS", f"{timeit(lambda: node.VALIDATE_INPUTS(input_types), number=10000) * 1e6:.2f}"),
+    ]
+    def invalidated():
+        tools.invalidate_input_types()
+        node.VALIDATE_INPUTS(input_types)
+    rows.append(("VALIDATE_INPUTS (invalidated)", f"{timeit(invalidated, number=10000) * 1e6:.2f}"))
+    print_table(["call", "us/call"], rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Checks that the static prefix of the prompt (system text, catalog and examples) is byte-for-byte
+the same across runs. Each run happens in a fresh interpreter with a different hash seed and
+with NODE_CLASS_MAPPINGS and the example files in a different order. Prints the prefix hash so it
+can be compared across machines with the same nodes installed (pass it back with --expect).
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+
+INSTRUCTIONS = "Generate two images of cats on skateboards. Avoid having humans in the images."
+
+def get_prefix_hashes(shuffle_seed):
+    from common import load_package
+    load_package()
+    import nodes
+    from abracadabra import nodes as abra_nodes
+    from abracadabra.cache import fingerprint
+
+    generator = random.Random(shuffle_seed)
+    items = list(nodes.NODE_CLASS_MAPPINGS.items())
+    generator.shuffle(items)
+    nodes.NODE_CLASS_MAPPINGS.clear()
+    nodes.NODE_CLASS_MAPPINGS.update(items)
+    listdir = os.listdir
+    def shuffled_listdir(path):
+        entries = listdir(path)
+        generator.shuffle(entries)
+        return entries
+    os.listdir = shuffled_listdir
+
+    hashes = {"prompt_version": abra_nodes.PROMPT_VERSION}
+    for stable in (True, False):
+        abra_nodes.ENABLE_STABLE_PREFIX = stable
+        examples = abra_nodes.select_examples(INSTRUCTIONS, {})
+        prefix = abra_nodes.build_prefix(examples, abra_nodes.get_node_summaries())
+        hashes["stable" if stable else "selected"] = fingerprint(prefix)
+    return hashes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--expect", help="Prefix hash from another machine to compare against")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(get_prefix_hashes(args.child)))
+        return
+
+    results = []
+    for run in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", str(run)],
+            check=True,
+            capture_output=True,
+            text=True,
+            env={**os.environ, "PYTHONHASHSEED": str(run), "PYTHONPATH": os.path.dirname(os.path.abspath(__file__))},
+        ).stdout
+        results.append(json.loads(output.strip().split("\n")[-1]))
+    ok = all(result == results[0] for result in results)
+    for key, value in results[0].items():
+        print(f"{key}: {value}")
+    if args.expect is not None and args.expect != results[0]["stable"]:
+        print(f"Stable prefix hash differs from the expected {args.expect}")
+        ok = False
+    if not ok:
+        print("Prompt prefix is NOT stable across runs:")
+        for result in results:
+            print(" ", result)
+        sys.exit(1)
+    print(f"Prompt prefix is stable across {args.runs} runs")
+
+if __name__ == "__main__":
+    main()
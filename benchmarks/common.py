@@ -0,0 +1,52 @@
+"""
+Shared helpers for the benchmark scripts. Run the scripts from the ComfyUI root directory
+(e.g. `python custom_nodes/abracadabra-comfyui/benchmarks/bench_validation.py`) so that
+`nodes` and `comfy` resolve to the ComfyUI installation.
+"""
+import importlib.util
+import os
+import sys
+import time
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_package(name="abracadabra"):
+    if name in sys.modules:
+        return sys.modules[name]
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    spec = importlib.util.spec_from_file_location(
+        name,
+        os.path.join(PACKAGE_DIR, "__init__.py"),
+        submodule_search_locations=[PACKAGE_DIR],
+    )
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def load_module(filename):
+    """Loads a single module of the package that doesn't depend on ComfyUI."""
+    name = "abracadabra_" + os.path.splitext(filename)[0]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PACKAGE_DIR, filename))
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def timeit(fn, repeat=5, number=1):
+    """Returns the best per-call time in seconds over `repeat` runs of `number` calls."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def print_table(headers, rows):
+    widths = [max(len(str(x)) for x in column) for column in zip(headers, *rows)]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(str(x).ljust(w) for x, w in zip(row, widths)))
@@ -0,0 +1,152 @@
+"""
+Minimal OpenAI-compatible chat-completions server for working offline. It answers every request
+with the code of the example whose instruction best matches the request's instruction, after an
+optional delay, and can be told to fail a fraction of requests with 429 or 500 responses.
+
+    python stub_server.py --port 8765 --latency 0.5 --failure-rate 0.1
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub python main.py
+"""
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+word_regex = re.compile(r"[a-z0-9]+")
+
+def load_responses(directory=EXAMPLES_DIR):
+    responses = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".py"):
+            continue
+        with open(os.path.join(directory, filename), "r") as f:
+            lines = f.read().split("\n")
+        instruction = lines[0][len("# Instruction:"):] if lines[0].startswith("# Instruction:") else ""
+        code = "\n".join(line for line in lines if not line.startswith("#"))
+        responses.append((set(word_regex.findall(instruction.lower())), f"```python\n{code.strip()}\n```\n"))
+    return responses
+
+def get_instruction(messages):
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            for line in message.get("content", "").split("\n"):
+                if line.startswith("Instruction:"):
+                    return line[len("Instruction:"):]
+            return message.get("content", "")
+    return ""
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, failure_rate=0.0, chunk_size=16, seed=0):
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+        self.responses = load_responses()
+        self.requests = 0
+
+    def respond(self, messages):
+        words = set(word_regex.findall(get_instruction(messages).lower()))
+        return max(self.responses, key=lambda response: len(response[0] & words))[1]
+
+class StubHandler(BaseHTTPRequestHandler):
+    server: StubServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        self.server.requests += 1
+        time.sleep(self.server.latency)
+        if self.server.random.random() < self.server.failure_rate:
+            status = self.server.random.choice([429, 500])
+            self.send_json(status, {"error": {"message": "Injected failure", "type": "stub_error", "code": status}})
+            return
+        content = self.server.respond(body.get("messages", []))
+        model = body.get("model", "stub")
+        created = int(time.time())
+        if body.get("stream", False):
+            self.send_stream(content, model, created)
+            return
+        prompt_tokens = sum(len(m.get("content") or "") for m in body.get("messages", [])) // 4
+        self.send_json(200, {
+            "id": f"chatcmpl-stub-{self.server.requests}",
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [
+                {"index": i, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                for i in range(body.get("n", 1) or 1)
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": prompt_tokens + len(content) // 4,
+            },
+        })
+
+    def send_stream(self, content, model, created):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        chunk_size = self.server.chunk_size
+        pieces = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        try:
+            for i, piece in enumerate(pieces + [None]):
+                chunk = {
+                    "id": f"chatcmpl-stub-{self.server.requests}",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"content": piece} if piece is not None else {},
+                        "finish_reason": None if piece is not None else "stop",
+                    }],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client aborted the stream early
+            pass
+
+def start_stub_server(port=0, **kwargs):
+    """Starts a stub server on a background thread and returns it along with its base URL."""
+    server = StubServer(("127.0.0.1", port), **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before responding")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests that fail with 429 or 500")
+    args = parser.parse_args()
+    server = StubServer(("127.0.0.1", args.port), latency=args.latency, failure_rate=args.failure_rate)
+    print(f"Serving chat completions on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
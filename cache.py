@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+MAX_CACHE_AGE = 30 * 24 * 60 * 60
+
+def fingerprint(value) -> str:
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True)
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+def get_cache_key(instructions, input_types, input_names, catalog_fingerprint, examples_fingerprint, model, prompt_version) -> str:
+    return fingerprint({
+        "instructions": instructions,
+        "input_types": input_types,
+        "input_names": input_names,
+        "catalog": catalog_fingerprint,
+        "examples": examples_fingerprint,
+        "model": model,
+        "prompt_version": prompt_version,
+    })
+
+class GraphCache:
+    """
+    Content-addressed on-disk cache of generated code that has already passed validation.
+    Entries are evicted least-recently-used first once the cache grows past `max_bytes`,
+    and unconditionally once they have not been used for `max_age` seconds.
+    """
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, max_age=MAX_CACHE_AGE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+            # The mtime doubles as the last-used time for LRU eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry.get("code")
+
+    def put(self, key, code):
+        """Stores `code`. The cache is only an optimization, so failing to write it isn't an error."""
+        path = self._path(key)
+        # Unique per thread, since several nodes can store the same key at once
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump({"code": code, "created": time.time()}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print("Abracadabra: could not write to the graph cache:", e)
+            self._unlink(tmp_path)
+            return
+        self.evict()
+
+    def remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        try:
+            filenames = os.listdir(self.directory)
+        except OSError:
+            return
+        now = time.time()
+        entries = []
+        for filename in filenames:
+            if not filename.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                self._unlink(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._unlink(path)
+            total -= size
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+graph_cache = GraphCache()
@@ -0,0 +1,106 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .streaming import extract_code
+
+# Ask for all candidates in a single request using the `n` parameter
+CANDIDATE_MODE_N = "n"
+# Send one request per candidate concurrently
+CANDIDATE_MODE_POOL = "pool"
+
+MAX_WORKERS = 8
+
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="abracadabra-candidate")
+
+def get_api_seed(seed):
+    # The API only accepts signed 64-bit seeds
+    return seed % 0x7fffffffffffffff
+
+class CandidateCancelled(Exception):
+    """Raised by a candidate request that stopped because another candidate already won."""
+
+def request_code(client, model, messages, seed, cancel=None):
+    """
+    Requests a single candidate. If a `cancel` event is given, the response is streamed and
+    closed as soon as the event is set, so that losing candidates stop generating and give up
+    their request slots instead of running to completion.
+    """
+    if cancel is None:
+        completion = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            seed=get_api_seed(seed),
+        )
+        return extract_code(completion.choices[0].message.content or "")
+    if cancel.is_set():
+        raise CandidateCancelled()
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        seed=get_api_seed(seed),
+        stream=True,
+    )
+    text = ""
+    try:
+        for chunk in stream:
+            if cancel.is_set():
+                raise CandidateCancelled()
+            if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+                text += chunk.choices[0].delta.content
+    finally:
+        # Closing the response cancels the rest of the generation
+        stream.close()
+    return extract_code(text)
+
+def first_valid_candidate(client, model, messages, count, seed, check, mode=CANDIDATE_MODE_N):
+    """
+    Generates `count` candidate programs and checks them in parallel with `check`, which takes
+    the code and returns a (builder, result, feedback, graph_errors) tuple whose feedback is
+    None for a valid graph. Candidates are ranked by their index, so the returned candidate is
+    the lowest-indexed valid one no matter which finishes first; any candidates after it are
+    cancelled, including requests that are already running in pool mode. If no candidate is
+    valid, the first one is returned so its feedback can be used for the next attempt.
+
+    Returns a (code, builder, result, feedback, graph_errors) tuple.
+    """
+    def check_candidate(code):
+        return (code,) + tuple(check(code))
+
+    if mode == CANDIDATE_MODE_N:
+        completion = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            n=count,
+            seed=get_api_seed(seed),
+        )
+        choices = sorted(completion.choices, key=lambda choice: choice.index)
+        futures = [executor.submit(check_candidate, extract_code(choice.message.content or "")) for choice in choices]
+    elif mode == CANDIDATE_MODE_POOL:
+        cancel = threading.Event()
+        futures = [
+            executor.submit(lambda i: check_candidate(request_code(client, model, messages, seed + i, cancel)), i)
+            for i in range(count)
+        ]
+    else:
+        raise ValueError(f"Unknown candidate mode: {mode}")
+
+    first = None
+    first_exception = None
+    for i, future in enumerate(futures):
+        try:
+            candidate = future.result()
+        except Exception as e:
+            if first_exception is None:
+                first_exception = e
+            continue
+        if candidate[3] is None:
+            if mode == CANDIDATE_MODE_POOL:
+                cancel.set()
+            for remaining in futures[i + 1:]:
+                remaining.cancel()
+            return candidate
+        if first is None:
+            first = candidate
+    if first is None:
+        assert first_exception is not None
+        raise first_exception
+    return first
@@ -0,0 +1,193 @@
+import nodes
+import re
+import time
+from .cache import fingerprint
+
+# Input types that are entered as widgets rather than connected via links
+WIDGET_TYPES = frozenset(["INT", "FLOAT", "STRING", "BOOLEAN"])
+
+word_regex = re.compile(r"[a-z0-9]+")
+name_word_regex = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+# Words too common in instructions and node names to say anything about relevance
+STOP_WORDS = frozenset(["a", "an", "and", "by", "for", "from", "of", "the", "to", "image", "images"])
+
+def link_types(value):
+    if not isinstance(value, str):
+        return []
+    return [t.strip() for t in value.split(",") if t.strip() not in WIDGET_TYPES and t.strip() != "*"]
+
+def get_description(cls):
+    docstr = cls.__doc__
+    if docstr is None:
+        return None
+    return docstr.strip()
+
+class NodeSchema:
+    def __init__(self, name, cls):
+        self.name = name
+        self.description = get_description(cls)
+        inputs = cls.INPUT_TYPES()
+        self.required = {k: v[0] for k, v in inputs.get("required", {}).items()}
+        self.defaults = {
+            k: v[1]["default"]
+            for k, v in inputs.get("required", {}).items()
+            if len(v) > 1 and isinstance(v[1], dict) and "default" in v[1]
+        }
+        self.optional = {k: v[0] for k, v in inputs.get("optional", {}).items()}
+        # Maps each input name to (type, is_required)
+        self.inputs = {k: (v, False) for k, v in self.optional.items()}
+        self.inputs.update((k, (v, True)) for k, v in self.required.items())
+        self.outputs = tuple(cls.RETURN_TYPES)
+        self.output_names = tuple(getattr(cls, "RETURN_NAMES", None) or ())
+        self.consumes = frozenset(t for v in self.inputs.values() for t in link_types(v[0]))
+        self.requires = frozenset(t for v in self.required.values() for t in link_types(v))
+        self.produces = frozenset(t for v in self.outputs for t in link_types(v))
+        self.keywords = frozenset(w.lower() for w in name_word_regex.findall(name) if len(w) > 1) - STOP_WORDS
+
+    def summary(self):
+        lines = [f"Node: '{self.name}'"]
+        if self.description:
+            lines.append(f"  Description: {self.description}")
+        for title, inputs in (("Required Inputs", self.required), ("Optional Inputs", self.optional)):
+            if len(inputs) > 0:
+                lines.append(f"  {title}:")
+                for k, v in inputs.items():
+                    if isinstance(v, list):
+                        lines.append(f"    '{k}': OneOf{v}")
+                    else:
+                        lines.append(f"    '{k}': {v}")
+        if len(self.required) == 0 and len(self.optional) == 0:
+            lines.append("  No Inputs")
+        if len(self.outputs) > 0:
+            lines.append("  Outputs:")
+            for idx, v in enumerate(self.outputs):
+                if len(self.output_names) > idx:
+                    lines.append(f"    {idx}: {v} - '{self.output_names[idx]}'")
+                else:
+                    lines.append(f"    {idx}: {v}")
+        else:
+            lines.append("  No Outputs")
+        return "\n".join(lines) + "\n"
+
+class NodeCatalog:
+    """
+    Structured index of the nodes the model is allowed to use. The index is only rebuilt
+    when `nodes.NODE_CLASS_MAPPINGS` or the allow-list changes; call `invalidate` to force
+    a rebuild (e.g. after adding model files that show up in a node's INPUT_TYPES).
+    """
+    def __init__(self, get_available_nodes):
+        self.get_available_nodes = get_available_nodes
+        self._signature = None
+        self._schemas = {}
+        self._allowed = frozenset()
+        self._return_types = {}
+        self._summary = ""
+        self._fingerprint = ""
+        self.build_time = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        self._signature = None
+
+    def _ensure_built(self):
+        signature = (tuple(self.get_available_nodes()), tuple(nodes.NODE_CLASS_MAPPINGS.items()))
+        if signature == self._signature:
+            self.hits += 1
+            return
+        self.misses += 1
+        start = time.perf_counter()
+        schemas = {}
+        # Sorted so the summary is byte-for-byte the same regardless of registration order
+        for name in sorted(set(signature[0])):
+            cls = nodes.NODE_CLASS_MAPPINGS.get(name)
+            if cls is None:
+                continue
+            schemas[name] = NodeSchema(name, cls)
+        self._schemas = schemas
+        self._allowed = frozenset(schemas)
+        self._return_types = {name: tuple(cls.RETURN_TYPES) for name, cls in signature[1]}
+        self._summary = "".join(schema.summary() for schema in schemas.values())
+        self._fingerprint = fingerprint(self._summary)
+        self._signature = signature
+        self.build_time = time.perf_counter() - start
+
+    @property
+    def schemas(self) -> dict[str, NodeSchema]:
+        self._ensure_built()
+        return self._schemas
+
+    @property
+    def allowed(self) -> frozenset[str]:
+        self._ensure_built()
+        return self._allowed
+
+    @property
+    def return_types(self) -> dict[str, tuple]:
+        """Output types of every installed node class, including ones outside the allow-list."""
+        self._ensure_built()
+        return self._return_types
+
+    @property
+    def summary(self) -> str:
+        self._ensure_built()
+        return self._summary
+
+    @property
+    def fingerprint(self) -> str:
+        self._ensure_built()
+        return self._fingerprint
+
+    def prune(self, instructions, input_types) -> list[str]:
+        """
+        Returns the names of the nodes relevant to a request: everything that can consume the
+        types reachable from `input_types`, nodes whose names match words in the instructions,
+        the producers of any linked inputs those nodes require that nothing else produces, and
+        every node without linked inputs that produces a type they require.
+        """
+        schemas = self.schemas
+        seed_types = set(t for v in input_types.values() for t in link_types(str(v)))
+        words = set(word_regex.findall(instructions.lower())) - STOP_WORDS
+        kept = set(name for name, schema in schemas.items() if len(schema.keywords & words) > 0)
+        if len(seed_types) == 0:
+            # Nothing to start from, so begin with the nodes that don't need any linked inputs
+            kept.update(name for name, schema in schemas.items() if len(schema.requires) == 0)
+        reachable = set(seed_types)
+        changed = True
+        while changed:
+            changed = False
+            reachable_count = len(reachable)
+            for name, schema in schemas.items():
+                if name not in kept and len(schema.consumes & reachable) > 0:
+                    kept.add(name)
+                    changed = True
+            for name in kept:
+                reachable.update(schemas[name].produces)
+            if len(reachable) > reachable_count:
+                changed = True
+            required = set(t for name in kept for t in schemas[name].requires)
+            missing = required - reachable
+            for name, schema in schemas.items():
+                if name in kept:
+                    continue
+                # Source nodes are kept even if the type is reachable some other way, e.g. an
+                # EmptyLatentImage for a KSampler when a VAEEncode could also make the latent
+                is_source = len(schema.requires) == 0
+                if len(schema.produces & missing) > 0 or (is_source and len(schema.produces & required) > 0):
+                    kept.add(name)
+                    changed = True
+        return [name for name in schemas if name in kept]
+
+    def pruned_summary(self, instructions, input_types) -> str:
+        schemas = self.schemas
+        return "".join(schemas[name].summary() for name in self.prune(instructions, input_types))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "build_time": self.build_time,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "nodes": len(self._schemas),
+        }
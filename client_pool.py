@@ -0,0 +1,224 @@
+import os
+import random
+import threading
+import time
+import types
+from collections import deque
+from concurrent.futures import Future
+from .cache import fingerprint
+
+MAX_CONCURRENT_REQUESTS = 8
+REQUESTS_PER_MINUTE = 500
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+LATENCY_WINDOW = 1000
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def is_retryable(e):
+    import openai
+    if isinstance(e, openai.APIConnectionError):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return False
+
+def get_backoff(attempt):
+    # "Full jitter" so that concurrent callers don't retry in lockstep
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+class ScheduledStream:
+    """
+    Wraps a streaming response so that its request keeps its scheduler slot until the stream is
+    exhausted, fails or is closed, since the generation is still running until then.
+    """
+    def __init__(self, stream, on_finish):
+        self.stream = stream
+        self.on_finish = on_finish
+        self.finished = False
+        self.lock = threading.Lock()
+
+    def _finish(self):
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+        self.on_finish()
+
+    def __iter__(self):
+        try:
+            yield from self.stream
+        finally:
+            self._finish()
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self._finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # Don't leak the slot if the stream is dropped without being closed
+        self._finish()
+
+class RequestScheduler:
+    """
+    Process-wide wrapper around a single OpenAI client, shared by every Abracadabra node so that
+    connections are kept alive and reused. Requests are limited to MAX_CONCURRENT_REQUESTS at a
+    time and REQUESTS_PER_MINUTE overall, retried with jittered backoff on 429 and 5xx responses,
+    and identical requests that are in flight at the same time share a single response.
+
+    It mirrors the part of the OpenAI client interface we use, so `scheduler.chat.completions.create`
+    can be called in place of `client.chat.completions.create`.
+    """
+    def __init__(self, max_concurrent=None, requests_per_minute=None):
+        if max_concurrent is None:
+            max_concurrent = MAX_CONCURRENT_REQUESTS
+        if requests_per_minute is None:
+            requests_per_minute = REQUESTS_PER_MINUTE
+        self._client = None
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._bucket = TokenBucket(requests_per_minute / 60, max_concurrent)
+        self._in_flight: dict[str, Future] = {}
+        self.queue_depth = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                # Imported here since openai takes a while to import and isn't needed until the first request
+                import openai
+                # Retries are handled by the scheduler so they can be coordinated across callers
+                self._client = openai.OpenAI(max_retries=0)
+            return self._client
+
+    def warm_up(self):
+        """Imports openai and creates the client, without making any requests."""
+        if not os.environ.get("OPENAI_API_KEY"):
+            # The client can't be created yet; the key may still be set before the first request
+            return
+        try:
+            self.client
+        except Exception as e:
+            print("Abracadabra: could not create the OpenAI client during warm-up:", e)
+
+    def create(self, **params):
+        if params.get("stream", False):
+            # A stream can only be consumed once, so it can't be shared
+            return self._send(params)
+        key = fingerprint(params)
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+        try:
+            response = self._send(params)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _send(self, params):
+        with self._lock:
+            self.queue_depth += 1
+        self._semaphore.acquire()
+        with self._lock:
+            self.queue_depth -= 1
+            self.active += 1
+        start = time.perf_counter()
+        def release(succeeded=True):
+            with self._lock:
+                self.active -= 1
+                if succeeded:
+                    self.completed += 1
+                    self.latencies.append(time.perf_counter() - start)
+            self._semaphore.release()
+        try:
+            attempt = 0
+            while True:
+                self._bucket.acquire()
+                start = time.perf_counter()
+                try:
+                    response = self.client.chat.completions.create(**params)
+                    break
+                except Exception as e:
+                    if attempt >= MAX_RETRIES or not is_retryable(e):
+                        with self._lock:
+                            self.failed += 1
+                        raise
+                    with self._lock:
+                        self.retries += 1
+                    time.sleep(get_backoff(attempt))
+                    attempt += 1
+        except BaseException:
+            release(succeeded=False)
+            raise
+        if params.get("stream", False):
+            # The generation runs until the stream ends, so the slot is held and the latency
+            # recorded until then
+            return ScheduledStream(response, release)
+        release()
+        return response
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            def percentile(p):
+                if len(latencies) == 0:
+                    return 0.0
+                return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+            return {
+                "queue_depth": self.queue_depth,
+                "active": self.active,
+                "completed": self.completed,
+                "failed": self.failed,
+                "retries": self.retries,
+                "coalesced": self.coalesced,
+                "latency_p50": percentile(0.5),
+                "latency_p95": percentile(0.95),
+            }
+
+scheduler = RequestScheduler()
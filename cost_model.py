@@ -0,0 +1,138 @@
+import json
+import os
+from comfy.graph_utils import GraphBuilder, is_link
+from .optimizer import get_topological_order
+
+# Recorded timings to calibrate the model with: a JSON list of {"class_type", "units", "seconds"}
+# objects, where units are the per-node units reported by CostModel.estimate
+COST_TIMINGS_FILE = os.path.join(os.path.dirname(__file__), "timings.json")
+
+SAMPLER = "sampler"
+VAE = "vae"
+IMAGE = "image"
+LOADER = "loader"
+OTHER = "other"
+
+# Rough seconds per unit on a consumer GPU running SD1.5. A unit is one sampling step of a single
+# 512x512 image for samplers, one 512x512 image for VAE and image nodes and one model for loaders.
+DEFAULT_COEFFICIENTS = {
+    SAMPLER: 0.05,
+    VAE: 0.1,
+    IMAGE: 0.01,
+    LOADER: 2.0,
+    OTHER: 0.001,
+}
+REFERENCE_PIXELS = 512 * 512
+# Assumed (width, height, batch size) of latents and images coming from outside the graph
+DEFAULT_SIZE = (512, 512, 1)
+SIZED_TYPES = ("LATENT", "IMAGE", "MASK")
+SIZE_INPUTS = ("samples", "latent_image", "latent", "pixels", "image", "images")
+
+def get_rule(class_type, inputs, output_types):
+    if "steps" in inputs and any(output == "LATENT" for output in output_types):
+        return SAMPLER
+    if "Loader" in class_type:
+        return LOADER
+    if class_type.startswith("VAE"):
+        return VAE
+    if any(output in ("IMAGE", "MASK") for output in output_types):
+        return IMAGE
+    return OTHER
+
+def get_number(inputs, *names):
+    for name in names:
+        value = inputs.get(name)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0:
+            return value
+    return None
+
+def get_input_size(inputs, sizes):
+    links = [inputs[name] for name in SIZE_INPUTS if is_link(inputs.get(name))]
+    links += [value for value in inputs.values() if is_link(value)]
+    for link in links:
+        if link[0] in sizes:
+            return sizes[link[0]]
+    return DEFAULT_SIZE
+
+def get_output_size(class_type, inputs, input_size):
+    width, height, batch = input_size
+    width = get_number(inputs, "width", "force_resize_width", "target_width") or width
+    height = get_number(inputs, "height", "force_resize_height", "target_height") or height
+    scale = get_number(inputs, "scale_by", "upscale_factor")
+    if scale is not None:
+        width, height = width * scale, height * scale
+    batch = get_number(inputs, "batch_size") or batch
+    if class_type == "RepeatLatentBatch":
+        batch *= get_number(inputs, "amount") or 1
+    elif class_type == "LatentFromBatch":
+        batch = min(batch, get_number(inputs, "length") or batch)
+    return (width, height, batch)
+
+def get_steps(inputs):
+    steps = get_number(inputs, "steps") or 0
+    end = get_number(inputs, "end_at_step")
+    start = get_number(inputs, "start_at_step") or 0
+    if end is not None:
+        steps = min(steps, end)
+    return max(steps - start, 0)
+
+class CostModel:
+    """
+    Static estimate of how long a graph takes to execute, computed from per-class rules: steps
+    times latent area times batch size for samplers, pixel counts for VAE and image nodes and a
+    fixed cost per model load. Latent and image sizes are propagated through the graph.
+    """
+    def __init__(self, coefficients=None):
+        self.coefficients = dict(DEFAULT_COEFFICIENTS if coefficients is None else coefficients)
+        # Calibrated seconds per unit for specific classes, taking precedence over the rules' defaults
+        self.class_coefficients = {}
+
+    def calibrate(self, records):
+        """Fits seconds per unit for each class in the records by least squares."""
+        totals = {}
+        for record in records:
+            units, seconds = record["units"], record["seconds"]
+            total = totals.setdefault(record["class_type"], [0.0, 0.0])
+            total[0] += units * seconds
+            total[1] += units * units
+        for class_type, (units_seconds, units_squared) in totals.items():
+            if units_squared > 0:
+                self.class_coefficients[class_type] = units_seconds / units_squared
+
+    def load(self, path=COST_TIMINGS_FILE):
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.calibrate(json.load(f))
+
+    def estimate(self, graph: GraphBuilder, return_types):
+        """
+        Returns the estimated total seconds and a dict of {node_id: {"class_type", "units", "seconds"}}.
+        `return_types` maps class types to their output types, as in NodeCatalog.return_types.
+        """
+        sizes = {}
+        nodes = {}
+        for node_id in get_topological_order(graph):
+            node = graph.nodes[node_id]
+            output_types = return_types.get(node.class_type, ())
+            input_size = get_input_size(node.inputs, sizes)
+            output_size = get_output_size(node.class_type, node.inputs, input_size)
+            if any(output in SIZED_TYPES for output in output_types):
+                sizes[node_id] = output_size
+            rule = get_rule(node.class_type, node.inputs, output_types)
+            if rule == SAMPLER:
+                width, height, batch = input_size
+                units = get_steps(node.inputs) * width * height * batch / REFERENCE_PIXELS
+            elif rule == VAE:
+                width, height, batch = input_size
+                units = width * height * batch / REFERENCE_PIXELS
+            elif rule == IMAGE:
+                width, height, batch = output_size
+                units = width * height * batch / REFERENCE_PIXELS
+            else:
+                units = 1
+            coefficient = self.class_coefficients.get(node.class_type, self.coefficients[rule])
+            nodes[node_id] = {"class_type": node.class_type, "units": units, "seconds": units * coefficient}
+        return sum(node["seconds"] for node in nodes.values()), nodes
+
+cost_model = CostModel()
+cost_model.load()
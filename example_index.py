@@ -0,0 +1,141 @@
+import math
+import os
+import re
+from .cache import fingerprint
+
+EXAMPLE_TOP_K = 4
+EXAMPLE_TOKEN_BUDGET = 4000
+
+word_regex = re.compile(r"[a-z0-9]+")
+declared_input_regex = re.compile(r"^- (\w+): (\S+)", re.MULTILINE)
+
+def tokenize(text):
+    return word_regex.findall(text.lower())
+
+def type_terms(types):
+    terms = []
+    for t in types:
+        terms.extend("type:" + x.strip().lower() for x in str(t).split(","))
+    return terms
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text and code
+    return len(text) // 4 + 1
+
+class Example:
+    def __init__(self, filename, contents):
+        self.filename = filename
+        prompt = ""
+        first_line, rest = contents.split("\n", 1)
+        while len(first_line) > 0 and first_line[0] == "#":
+            prompt += first_line[1:].strip() + "\n"
+            first_line, rest = rest.split("\n", 1)
+        self.prompt = prompt
+        self.code = first_line + '\n' + rest
+        instruction = ""
+        for line in prompt.splitlines():
+            if line.startswith("Instruction:"):
+                instruction = line[len("Instruction:"):].strip()
+        self.input_types = [t for _, t in declared_input_regex.findall(prompt)]
+        self.terms = tokenize(instruction) + type_terms(self.input_types)
+        self.tokens = estimate_tokens(self.prompt) + estimate_tokens(self.code)
+
+class ExampleIndex:
+    """
+    In-memory index of the files in `examples/`, reloaded only when a file is added,
+    removed or modified. Examples are ranked with BM25 over their instruction header and
+    declared input types, so the prompt only carries the ones relevant to a request.
+    """
+    k1 = 1.5
+    b = 0.75
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._signature = None
+        self._examples = []
+        self._fingerprint = ""
+        self._document_frequency = {}
+        self._average_length = 0.0
+
+    def invalidate(self):
+        self._signature = None
+
+    def _ensure_loaded(self):
+        signature = []
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(".py"):
+                continue
+            path = os.path.join(self.directory, filename)
+            signature.append((filename, os.stat(path).st_mtime_ns))
+        signature = tuple(signature)
+        if signature == self._signature:
+            return
+        examples = []
+        for filename, _ in signature:
+            with open(os.path.join(self.directory, filename), "r") as f:
+                examples.append(Example(filename, f.read()))
+        document_frequency = {}
+        for example in examples:
+            for term in set(example.terms):
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        self._examples = examples
+        self._document_frequency = document_frequency
+        self._average_length = sum(len(e.terms) for e in examples) / max(len(examples), 1)
+        self._fingerprint = fingerprint([(e.prompt, e.code) for e in examples])
+        self._signature = signature
+
+    @property
+    def examples(self) -> list[Example]:
+        self._ensure_loaded()
+        return self._examples
+
+    @property
+    def fingerprint(self) -> str:
+        self._ensure_loaded()
+        return self._fingerprint
+
+    def score(self, example: Example, query_terms):
+        count = len(self._examples)
+        length_norm = self.k1 * (1 - self.b + self.b * len(example.terms) / max(self._average_length, 1))
+        score = 0.0
+        for term in set(query_terms):
+            frequency = example.terms.count(term)
+            if frequency == 0:
+                continue
+            df = self._document_frequency.get(term, 0)
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            score += idf * frequency * (self.k1 + 1) / (frequency + length_norm)
+        return score
+
+    def select_all(self, token_budget=None) -> list[Example]:
+        """Returns the examples in filename order, up to `token_budget`, regardless of the request."""
+        if token_budget is None:
+            token_budget = EXAMPLE_TOKEN_BUDGET
+        selected = []
+        used = 0
+        for example in self.examples:
+            if used + example.tokens > token_budget and len(selected) > 0:
+                continue
+            selected.append(example)
+            used += example.tokens
+        return selected
+
+    def select(self, instructions, input_types, top_k=None, token_budget=None) -> list[Example]:
+        """Returns up to `top_k` of the most relevant examples that fit within `token_budget`."""
+        if top_k is None:
+            top_k = EXAMPLE_TOP_K
+        if token_budget is None:
+            token_budget = EXAMPLE_TOKEN_BUDGET
+        self._ensure_loaded()
+        query_terms = tokenize(instructions) + type_terms(input_types.values())
+        ranked = sorted(self._examples, key=lambda e: (-self.score(e, query_terms), e.filename))
+        selected = []
+        used = 0
+        for example in ranked:
+            if len(selected) >= top_k:
+                break
+            if used + example.tokens > token_budget and len(selected) > 0:
+                continue
+            selected.append(example)
+            used += example.tokens
+        return selected
@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = "abracadabra_"
+# Set to a path to export metrics after every generation. Paths ending in .prom are written in
+# the Prometheus text format (e.g. for node_exporter's textfile collector), anything else as JSON.
+METRICS_FILE = None
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+class Metrics:
+    """
+    Thread-safe counters, timings and gauges for the generation pipeline. Timings are kept as
+    Prometheus-style summaries (count and sum) along with the maximum observed value.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: dict[str, dict[tuple, float]] = {}
+        self.summaries: dict[str, dict[tuple, list[float]]] = {}
+        self.collectors = {}
+
+    def increment(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.summaries.setdefault(name, {})
+            summary = series.setdefault(key, [0, 0.0, value])
+            summary[0] += 1
+            summary[1] += value
+            summary[2] = max(summary[2], value)
+
+    @contextmanager
+    def span(self, phase, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("phase_seconds", time.perf_counter() - start, phase=phase, **labels)
+
+    def add_collector(self, name, collect):
+        """Registers a function returning a dict of numbers that are exported as gauges."""
+        with self.lock:
+            self.collectors[name] = collect
+
+    def snapshot(self):
+        with self.lock:
+            counters = {name: dict(series) for name, series in self.counters.items()}
+            summaries = {name: {k: list(v) for k, v in series.items()} for name, series in self.summaries.items()}
+            collectors = dict(self.collectors)
+        gauges = {}
+        for name, collect in collectors.items():
+            for k, v in collect().items():
+                if isinstance(v, (int, float)):
+                    gauges[f"{name}_{k}"] = v
+        return counters, summaries, gauges
+
+    def to_dict(self):
+        counters, summaries, gauges = self.snapshot()
+        def label_key(labels):
+            return ",".join(f"{k}={v}" for k, v in labels)
+        return {
+            "counters": {name: {label_key(k): v for k, v in series.items()} for name, series in counters.items()},
+            "summaries": {
+                name: {label_key(k): {"count": v[0], "sum": v[1], "max": v[2]} for k, v in series.items()}
+                for name, series in summaries.items()
+            },
+            "gauges": gauges,
+        }
+
+    def to_prometheus(self):
+        counters, summaries, gauges = self.snapshot()
+        lines = []
+        for name, series in sorted(counters.items()):
+            lines.append(f"# TYPE {PREFIX}{name} counter")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{PREFIX}{name}{format_labels(labels)} {value}")
+        for name, series in sorted(summaries.items()):
+            lines.append(f"# TYPE {PREFIX}{name} summary")
+            for labels, (count, total, maximum) in sorted(series.items()):
+                lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {count}")
+                lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"# TYPE {PREFIX}{name}_max gauge")
+            for labels, (count, total, maximum) in sorted(series.items()):
+                lines.append(f"{PREFIX}{name}_max{format_labels(labels)} {maximum}")
+        for name, value in sorted(gauges.items()):
+            lines.append(f"# TYPE {PREFIX}{name} gauge")
+            lines.append(f"{PREFIX}{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        if path.endswith(".prom"):
+            contents = self.to_prometheus()
+        else:
+            contents = json.dumps(self.to_dict(), indent=1)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(contents)
+        os.replace(tmp_path, path)
+
+    def export(self):
+        if METRICS_FILE is not None:
+            self.write(METRICS_FILE)
+
+metrics = Metrics()
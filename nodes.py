@@ -1,21 +1,75 @@
+import copy
 import nodes
 import os
 import random
 import re
-from openai import OpenAI
-from openai.types.chat import ChatCompletionMessageParam
+import threading
+import time
+from typing import TYPE_CHECKING
 from .tools import VariantSupport
+from .cache import fingerprint, get_cache_key, graph_cache
+from .semantic_cache import get_signature_key, semantic_cache
+from .catalog import NodeCatalog
+from .example_index import ExampleIndex, estimate_tokens
+from .validation import EXEC_ERROR, UNAVAILABLE_NODE, GraphError, validate_graph
+from .streaming import FLOW_CONTROL_ERROR, extract_code, stream_code
+from .candidates import CANDIDATE_MODE_N, first_valid_candidate
+from .client_pool import scheduler
+from .prefetch import prefetcher
+from .batch import BATCH_FORMAT, get_batch_instructions, split_batch_response, split_instructions
+from .metrics import metrics
+from .autofix import auto_repair
+from .static_graph import FLOW_CONTROL, build_static_graph
+from .optimizer import optimize_graph
+from .cost_model import cost_model
+from .patching import apply_patch, get_exception_lineno, get_failing_statements, get_repair_prompt
 from comfy.graph_utils import GraphBuilder, is_link
 from comfy.graph import DynamicPrompt
 
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletionMessageParam
+
 indentation_regex = re.compile(r"^[ \t]+")
 
 ENABLE_ALL_NODES = False
-def get_description(cls):
-    docstr = cls.__doc__
-    if docstr is None:
-        return None
-    return docstr.strip()
+ENABLE_GRAPH_CACHE = True
+# Reuse the code generated for earlier instructions with the same content words, i.e. that only
+# differ in case, punctuation and words such as articles. Off by default since the graph is reused
+# without asking the model, so a false match silently produces the wrong graph.
+ENABLE_SEMANTIC_CACHE = False
+ENABLE_CATALOG_PRUNING = True
+# Send the full catalog and the same examples with every request, so that the start of the prompt
+# is identical across requests and can be served from the provider's prompt cache. Catalog
+# pruning and example selection only apply when this is off.
+ENABLE_STABLE_PREFIX = False
+ENABLE_STREAMING = True
+# Set above 1 to generate several candidates in parallel and keep the first valid one
+NUM_CANDIDATES = 1
+CANDIDATE_MODE = CANDIDATE_MODE_N
+# Retry with only the latest attempt and ask for fixes to the failing statements
+ENABLE_TARGETED_REPAIR = True
+# Fix mechanically fixable graph errors locally before asking the model
+ENABLE_AUTO_REPAIR = True
+# Build graphs by interpreting the generated code's syntax tree rather than exec'ing it
+ENABLE_STATIC_GRAPH = True
+# Merge duplicate nodes and drop unused ones before handing the graph to ComfyUI
+ENABLE_GRAPH_OPTIMIZER = True
+# Link to identical loaders, encoders, etc. that the enclosing workflow already has
+ENABLE_WORKFLOW_REUSE = True
+MODEL = "gpt-3.5-turbo"
+# Build the catalog and example index and create the API client in the background after startup,
+# so the first generation doesn't pay for it. The delay lets other custom nodes register first.
+# Makes no API requests, and the client is only created if OPENAI_API_KEY is set.
+ENABLE_WARM_UP = False
+WARM_UP_DELAY = 5.0
+# Start generating as soon as a prompt is queued rather than when the node is executed, so that
+# the request overlaps with upstream nodes. Uses API quota for prompts that fail validation.
+ENABLE_PREFETCH = False
+# Print full prompts and responses to stdout
+VERBOSE = False
+examples_dir = os.path.join(os.path.dirname(__file__), "examples")
+# Anything with an OpenAI-compatible `chat.completions.create`, such as the backends in backends.py
+completion_backend = scheduler
 
 def get_available_nodes():
     if ENABLE_ALL_NODES:
@@ -110,93 +164,226 @@ def get_available_nodes():
             "MasqueradeIncrementer",
         ]
 
+node_catalog = NodeCatalog(get_available_nodes)
+example_index = ExampleIndex(examples_dir)
+metrics.add_collector("catalog", node_catalog.stats)
+metrics.add_collector("scheduler", scheduler.stats)
+metrics.add_collector("prefetch", prefetcher.stats)
+
 def get_partial_graph_errors(graph: GraphBuilder, existing_graph: DynamicPrompt):
-    errors = []
-    for _, node in graph.nodes.items():
-        class_type = node.class_type
-        if class_type not in get_available_nodes():
-            errors.append(f"Node type '{node['class_type']}' is not available in this environment.")
-        cls = nodes.NODE_CLASS_MAPPINGS[class_type]
-        inputs = cls.INPUT_TYPES()
-        all_inputs = {}
-        all_inputs.update(inputs.get("required", {}))
-        all_inputs.update(inputs.get("optional", {}))
-        for k, v in node.inputs.items():
-            if k not in all_inputs:
-                errors.append(f"Node type '{class_type}' does not have an input named '{k}'")
-            else:
-                input_type = all_inputs[k][0]
-                if is_link(v):
-                    from_id, idx = v
-                    from_node = graph.nodes.get(from_id, None)
-                    from_class_type = None
-                    if from_node is None:
-                        from_node = existing_graph.get_node(from_id)
-                        if from_node is not None:
-                            from_class_type = from_node["class_type"]
-                    else:
-                        from_class_type = from_node.class_type
-                    if from_node is None:
-                        errors.append(f"Node of type '{class_type}' has an input from an invalid node: '{from_id}'")
-                        continue
-                    assert from_class_type is not None
-                    from_cls = nodes.NODE_CLASS_MAPPINGS[from_class_type]
-                    from_outputs = from_cls.RETURN_TYPES
-                    if idx >= len(from_outputs):
-                        errors.append(f"Node of type '{class_type}' is attempting to use output {idx} from node of type '{from_class_type}' which only has {len(from_outputs)} outputs.")
-                        continue
-                    from_output = from_outputs[idx]
-                    if from_output != input_type:
-                        errors.append(f"The {k} input of node of type '{class_type}' is expecting type '{input_type}' but got type '{from_output}' from node of type '{from_class_type}'.")
-                        continue
-        for k, v in inputs.get("required", []).items():
-            if k not in node.inputs:
-                errors.append(f"Node of type '{class_type}' is missing a required input '{k}'.")
+    errors = validate_graph(graph, existing_graph, node_catalog)
     if len(errors) > 0:
-        return errors
+        return [str(error) for error in errors]
     return None
 
 def get_node_summaries():
-    result = ""
-    for nodename in get_available_nodes():
-        nodedef = nodes.NODE_CLASS_MAPPINGS[nodename]
-        result += f"Node: '{nodename}'\n"
-        description = get_description(nodedef)
-        if description:
-            result += f"  Description: {description}\n"
-        inputs = nodedef.INPUT_TYPES()
-        required = inputs.get("required", {})
-        if len(required) > 0:
-            result += f"  Required Inputs:\n"
-            for k, v in required.items():
-                if isinstance(v[0], list):
-                    result += f"    '{k}': OneOf{v[0]}\n"
-                else:
-                    result += f"    '{k}': {v[0]}\n"
-        optional = inputs.get("optional", {})
-        if len(optional) > 0:
-            result += f"  Optional Inputs:\n"
-            for k, v in optional.items():
-                if isinstance(v[0], list):
-                    result += f"    '{k}': OneOf{v[0]}\n"
-                else:
-                    result += f"    '{k}': {v[0]}\n"
-        if len(required) == 0 and len(optional) == 0:
-            result += f"  No Inputs\n"
-
-        outputs = nodedef.RETURN_TYPES
-        output_names = getattr(nodedef, "RETURN_NAMES", None)
-        if len(outputs) > 0:
-            result += f"  Outputs:\n"
-            for idx in range(len(outputs)):
-                v = outputs[idx]
-                if output_names is not None and len(output_names) > idx:
-                    result += f"    {idx}: {v} - '{output_names[idx]}'\n"
-                else:
-                    result += f"    {idx}: {v}\n"
+    return node_catalog.summary
+
+SYSTEM_PROMPT = "You are tasked with developing node-graph based workflows according to the user's instructions. You will be given the list of available nodes as well as a number of examples of creating workflows using those nodes. Your task is to respond with a chunk of Python code that creates a node graph to fulfill the user's request. You should not do ANY work in Python other than creating the node graphs. You should never use loops or conditionals in Python. Instead, make use of image batches when possible. (All IMAGE types are actually a batch of images.) Ensure you include all required inputs for each node."
+CATALOG_HEADER = "Here is the definition of available nodes. Do not attempt to use any nodes that are not listed here.\n\n"
+PROMPT_TEMPLATE = """Instruction: {instructions}
+Available locals:
+- g: GraphBuilder
+- RAND: fn() -> int
+- result: dict - Set the 'outputs' key to a list of outputs to return. Ensure that it is a list and not a single value.
+"""
+LINKED_INPUT_TEMPLATE = "- {name}: {type} - Comes from output named '{output_name}'. Pass directly to sockets of type {type} as {output_name}\n"
+INPUT_TEMPLATE = "- {name}: {type} - Pass directly to sockets of type {type}\n"
+# Changes whenever the prompt's wording does, so that cached responses to older prompts aren't reused
+PROMPT_VERSION = fingerprint([SYSTEM_PROMPT, CATALOG_HEADER, PROMPT_TEMPLATE, LINKED_INPUT_TEMPLATE, INPUT_TEMPLATE])[:16]
+
+def get_catalog_message(node_summaries) -> "ChatCompletionMessageParam":
+    return {"role": "system", "content": CATALOG_HEADER + node_summaries}
+
+def select_examples(instructions, input_types):
+    if ENABLE_STABLE_PREFIX:
+        return example_index.select_all()
+    return example_index.select(instructions, input_types)
+
+def build_prefix(examples, node_summaries) -> list["ChatCompletionMessageParam"]:
+    """
+    The part of the prompt that doesn't depend on the request, in a canonical order (the catalog
+    is sorted by node name and examples by filename) so that identical inputs give identical bytes.
+    """
+    messages: list["ChatCompletionMessageParam"] = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        get_catalog_message(node_summaries),
+    ]
+    for example in sorted(examples, key=lambda example: example.filename):
+        messages.append({"role": "user", "content": example.prompt})
+        messages.append({"role": "assistant", "content": example.code})
+    return messages
+
+def build_request(instructions, input_types, input_names) -> "ChatCompletionMessageParam":
+    prompt = PROMPT_TEMPLATE.format(instructions=instructions)
+    for k, v in sorted(input_types.items()):
+        if k in input_names:
+            prompt += LINKED_INPUT_TEMPLATE.format(name=k, type=v, output_name=input_names[k])
         else:
-            result += f"  No Outputs\n"
-    return result
+            prompt += INPUT_TEMPLATE.format(name=k, type=v)
+    return {"role": "user", "content": prompt}
+
+def build_messages(instructions, input_types, input_names, examples, node_summaries) -> list["ChatCompletionMessageParam"]:
+    # Everything specific to the request goes last so that providers can cache the shared prefix
+    return build_prefix(examples, node_summaries) + [build_request(instructions, input_types, input_names)]
+
+def get_input_signature(dynprompt: DynamicPrompt, kwargs):
+    input_types = {}
+    input_names = {}
+    for k, v in kwargs.items():
+        if is_link(v):
+            from_id, idx = v
+            class_type = dynprompt.get_node(from_id)['class_type']
+            cls = nodes.NODE_CLASS_MAPPINGS[class_type]
+            ret_type = cls.RETURN_TYPES[idx]
+            if hasattr(cls, "RETURN_NAMES"):
+                input_names[k] = cls.RETURN_NAMES[idx]
+            input_types[k] = ret_type
+            if VERBOSE:
+                print(f"Input {k} is a link from {from_id} with type {ret_type}")
+        else:
+            if isinstance(v, str):
+                input_types[k] = "STRING"
+            elif isinstance(v, int):
+                input_types[k] = "INTEGER"
+            elif isinstance(v, float):
+                input_types[k] = "FLOAT"
+            elif isinstance(v, bool):
+                input_types[k] = "BOOLEAN"
+            else:
+                input_types[k] = type(v).__name__
+    return input_types, input_names
+
+def build_graph(code, seed, kwargs, prefix=None):
+    objcode = compile(code, "<string>", "exec")
+    result = {}
+    builder = GraphBuilder(prefix)
+    generator = random.Random(seed)
+    def rand():
+        return generator.randint(0, 0xffffffffffffffff)
+
+    locals = {
+        "g": builder,
+        "RAND": rand,
+        "result": result,
+        **kwargs
+    }
+    globals = {}
+    exec(objcode, globals, locals)
+    return builder, result
+
+def optimize(builder, result, dynprompt, unique_id):
+    if ENABLE_GRAPH_OPTIMIZER:
+        return optimize_graph(builder, result, dynprompt if ENABLE_WORKFLOW_REUSE else None, unique_id)
+    return {}
+
+def get_budget_feedback(cost, node_costs, budget):
+    expensive = sorted(node_costs.values(), key=lambda node: node["seconds"], reverse=True)[:3]
+    details = ", ".join(f"{node['class_type']} ({node['seconds']:.1f}s)" for node in expensive)
+    return f"The graph is estimated to take {cost:.1f} seconds to run, which is over the budget of {budget:.1f} seconds. The most expensive nodes are: {details}. Please make the graph cheaper, for example by using fewer sampling steps, smaller images or smaller batches. Do not apologize -- just respond with the updated code."
+
+def record_token_usage(messages, response_text, usage=None):
+    """
+    Counts the tokens of a request. Uses the counts the API reports when a response has them;
+    otherwise (streamed or candidate responses) falls back to separately named estimates.
+    """
+    if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+        metrics.increment("prompt_tokens_total", usage.prompt_tokens)
+        metrics.increment("completion_tokens_total", usage.completion_tokens or 0)
+        return
+    metrics.increment("prompt_tokens_estimated_total", sum(estimate_tokens(message["content"]) for message in messages))
+    metrics.increment("completion_tokens_estimated_total", estimate_tokens(response_text))
+
+def check_code(code, seed, kwargs, dynprompt, unique_id=None, budget=0.0, prefix=None):
+    """
+    Builds and validates the graph for generated code. Returns a (builder, result, feedback, graph_errors)
+    tuple where feedback is the message to send back to the model, or None if the graph is valid and
+    its estimated cost is within the budget (in seconds, 0 for unlimited). The builder uses `prefix`
+    for its node ids if given, and otherwise allocates the next prefix of the node being executed.
+    """
+    if ENABLE_STATIC_GRAPH:
+        with metrics.span("exec"):
+            builder, result, code_errors, failed_inputs, node_lines = build_static_graph(code, seed, kwargs, prefix)
+    else:
+        if indentation_regex.match(code) is not None:
+            metrics.increment("failures_total", reason="flow_control")
+            return None, None, FLOW_CONTROL_ERROR, []
+        try:
+            with metrics.span("exec"):
+                builder, result = build_graph(code, seed, kwargs, prefix)
+        except Exception as e:
+            metrics.increment("failures_total", reason="exec_exception")
+            exec_error = GraphError(EXEC_ERROR, f"{type(e).__name__}: {e}", lineno=get_exception_lineno(e))
+            return None, None, f"Your code failed with the following error. Please fix that error and try again. Do not apologize -- just respond with the updated code. Error: {e}", [exec_error]
+        code_errors, failed_inputs, node_lines = [], set(), {}
+    with metrics.span("validation"):
+        graph_errors = validate_graph(builder, dynprompt, node_catalog)
+        # Inputs whose values were invalid have already been reported
+        graph_errors = [error for error in graph_errors if (error.node_id, error.input_name) not in failed_inputs]
+    if len(graph_errors) > 0 and ENABLE_AUTO_REPAIR:
+        with metrics.span("auto_repair"):
+            fixes, graph_errors = auto_repair(builder, dynprompt, graph_errors, node_catalog)
+            graph_errors = [error for error in graph_errors if (error.node_id, error.input_name) not in failed_inputs]
+        if VERBOSE:
+            for fix in fixes:
+                print("Automatically repaired generated graph:", fix)
+        metrics.increment("auto_fixes_total", len(fixes))
+    for error in graph_errors:
+        # So repairs are asked about the statement that created the node
+        if error.lineno is None and error.node_id in node_lines:
+            error.lineno = node_lines[error.node_id]
+    graph_errors = code_errors + graph_errors
+    if len(graph_errors) > 0:
+        if any(error.kind == FLOW_CONTROL for error in code_errors):
+            metrics.increment("failures_total", reason="flow_control")
+        elif len(code_errors) > 0:
+            metrics.increment("failures_total", reason="unsupported_code")
+        else:
+            metrics.increment("failures_total", reason="graph_errors")
+        for error in graph_errors:
+            metrics.increment("graph_errors_total", kind=error.kind)
+        errors = [str(error) for error in graph_errors]
+        return builder, result, f"Your code failed to generate a valid graph. Please fix the following errors and try again. Do not apologize -- just respond with the updated code. Errors: {errors}", graph_errors
+    if budget > 0:
+        # Estimate the graph as it will be run, without changing the one that is returned
+        optimized_builder, optimized_result = copy.deepcopy((builder, result))
+        optimize(optimized_builder, optimized_result, dynprompt, unique_id)
+        cost, node_costs = cost_model.estimate(optimized_builder, node_catalog.return_types)
+        if cost > budget:
+            metrics.increment("failures_total", reason="over_budget")
+            return builder, result, get_budget_feedback(cost, node_costs, budget), []
+    return builder, result, None, []
+
+def finalize_graph(builder, result, dynprompt, unique_id):
+    with metrics.span("optimize"):
+        original_cost, _ = cost_model.estimate(builder, node_catalog.return_types)
+        removed = optimize(builder, result, dynprompt, unique_id)
+        cost, _ = cost_model.estimate(builder, node_catalog.return_types)
+    for reason, class_types in removed.items():
+        for class_type in class_types:
+            metrics.increment("optimizer_nodes_removed_total", reason=reason, class_type=class_type)
+    metrics.increment("optimizer_estimated_seconds_saved_total", original_cost - cost)
+    metrics.observe("estimated_cost_seconds", cost)
+    if VERBOSE and any(len(class_types) > 0 for class_types in removed.values()):
+        print(f"Optimized graph (estimated {original_cost - cost:.1f}s saved):", ", ".join(f"{reason} {class_types}" for reason, class_types in removed.items()))
+    with metrics.span("finalize"):
+        return {
+            "ui": {"estimated_seconds": [round(cost, 2)]},
+            "result": tuple(result['outputs']),
+            "expand": builder.finalize(),
+        }
+
+def warm_up():
+    time.sleep(WARM_UP_DELAY)
+    with metrics.span("warm_up"):
+        get_node_summaries()
+        example_index.examples
+        if completion_backend is scheduler:
+            scheduler.warm_up()
+
+def start_warm_up():
+    if ENABLE_WARM_UP:
+        threading.Thread(target=warm_up, name="abracadabra-warm-up", daemon=True).start()
 
 class AbracadabraNodeDefSummary:
     @classmethod
@@ -226,10 +413,13 @@ class AbracadabraNode:
                 "seed": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),
             },
             "optional": {
-                f"input{i}": ("*", {"rawLink": True}) for i in range(1, cls.NUM_INPUTS + 1)
+                # Estimated seconds the generated graph may take to run, 0 for unlimited
+                "budget": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 3600.0, "step": 1.0}),
+                **{f"input{i}": ("*", {"rawLink": True}) for i in range(1, cls.NUM_INPUTS + 1)},
             },
             "hidden": {
                 "dynprompt": "DYNPROMPT",
+                "unique_id": "UNIQUE_ID",
             }
         }
 
@@ -238,126 +428,350 @@ class AbracadabraNode:
 
     CATEGORY = "Abracadabra"
 
-    def do_magic(self, instructions, seed, dynprompt, **kwargs):
-        messages: list[ChatCompletionMessageParam] = [
-            {"role": "system", "content": "You are tasked with developing node-graph based workflows according to the user's instructions. You will be given the list of available nodes as well as a number of examples of creating workflows using those nodes. Your task is to respond with a chunk of Python code that creates a node graph to fulfill the user's request. You should not do ANY work in Python other than creating the node graphs. You should never use loops or conditionals in Python. Instead, make use of image batches when possible. (All IMAGE types are actually a batch of images.) Ensure you include all required inputs for each node."},
-            {"role": "system", "content": "Here is the definition of available nodes. Do not attempt to use any nodes that are not listed here.\n\n" + get_node_summaries()},
-        ]
-        # Iterate through the 'examples/' folder and add the contents of each file to the messages
-        examples_dir = os.path.join(os.path.dirname(__file__), "examples")
-        test_code = ""
-        match = "beaver"
-        for filename in os.listdir(examples_dir):
-            with open(os.path.join(examples_dir, filename), "r") as f:
-                contents = f.read()
-                prompt = ""
-                first_line, rest = contents.split("\n", 1)
-                while len(first_line) > 0 and first_line[0] == "#":
-                    prompt += first_line[1:].strip() + "\n"
-                    first_line, rest = rest.split("\n", 1)
-                messages.append({"role": "user", "content": prompt})
-                code = first_line + '\n' + rest
-                messages.append({"role": "assistant", "content": code})
-                if match in prompt:
-                    test_code = code
-
-        input_types = {}
-        input_names = {}
-        for k, v in kwargs.items():
-            if is_link(v):
-                from_id, idx = v
-                class_type = dynprompt.get_node(from_id)['class_type']
-                cls = nodes.NODE_CLASS_MAPPINGS[class_type]
-                ret_type = cls.RETURN_TYPES[idx]
-                if hasattr(cls, "RETURN_NAMES"):
-                    input_names[k] = cls.RETURN_NAMES[idx]
-                input_types[k] = ret_type
-                print(f"Input {k} is a link from {from_id} with type {ret_type}")
-            else:
-                if isinstance(v, str):
-                    input_types[k] = "STRING"
-                elif isinstance(v, int):
-                    input_types[k] = "INTEGER"
-                elif isinstance(v, float):
-                    input_types[k] = "FLOAT"
-                elif isinstance(v, bool):
-                    input_types[k] = "BOOLEAN"
+    def do_magic(self, instructions, seed, dynprompt, unique_id=None, budget=0.0, **kwargs):
+        metrics.increment("generations_total")
+        try:
+            with metrics.span("total"):
+                graph = None
+                if ENABLE_PREFETCH:
+                    graph = adopt_prefetched(instructions, seed, dynprompt, unique_id, budget, kwargs)
+                if graph is None:
+                    _, builder, result = self.generate(instructions, seed, dynprompt, unique_id, budget, kwargs)
                 else:
-                    input_types[k] = type(v).__name__
-        prompt = f"""Instruction: {instructions}
-Available locals:
-- g: GraphBuilder
-- RAND: fn() -> int
-- result: dict - Set the 'outputs' key to a list of outputs to return. Ensure that it is a list and not a single value.
-"""
-        for k, v in input_types.items():
-            if k in input_names:
-                prompt += f"- {k}: {v} - Comes from output named '{input_names[k]}'. Pass directly to sockets of type {v} as {input_names[k]}\n"
-            else:
-                prompt += f"- {k}: {v} - Pass directly to sockets of type {v}\n"
-        messages.append({"role": "user", "content": prompt})
+                    builder, result = graph
+                output = finalize_graph(builder, result, dynprompt, unique_id)
+            metrics.observe("expanded_graph_nodes", len(output["expand"]))
+            return output
+        finally:
+            metrics.export()
 
-        client = OpenAI()
+    def generate(self, instructions, seed, dynprompt, unique_id, budget, kwargs, prefix=None):
+        """
+        Returns the code for a valid graph along with the graph's builder and result. Builders use
+        `prefix` for their node ids; see check_code.
+        """
+        with metrics.span("signature"):
+            input_types, input_names = get_input_signature(dynprompt, kwargs)
+        with metrics.span("examples"):
+            examples = select_examples(instructions, input_types)
+
+        cache_key = None
+        if ENABLE_GRAPH_CACHE:
+            with metrics.span("cache_lookup"):
+                cache_key = get_cache_key(
+                    instructions,
+                    input_types,
+                    input_names,
+                    node_catalog.fingerprint,
+                    fingerprint([example.filename for example in examples] + [example_index.fingerprint]),
+                    MODEL,
+                    PROMPT_VERSION,
+                )
+                code = graph_cache.get(cache_key)
+            if code is not None:
+                builder, result, feedback, _ = check_code(code, seed, kwargs, dynprompt, unique_id, budget, prefix)
+                if feedback is None:
+                    metrics.increment("cache_hits_total")
+                    if VERBOSE:
+                        print("Using cached graph for instructions:", instructions)
+                    return code, builder, result
+                print("Discarding invalid cached graph:\n", feedback)
+                graph_cache.remove(cache_key)
+            metrics.increment("cache_misses_total")
+
+        signature_key = None
+        if ENABLE_SEMANTIC_CACHE:
+            with metrics.span("semantic_cache_lookup"):
+                signature_key = get_signature_key(input_types, input_names, node_catalog.fingerprint, MODEL, PROMPT_VERSION)
+                match = semantic_cache.lookup(instructions, signature_key)
+            if match is not None:
+                matched_instructions, code = match
+                builder, result, feedback, _ = check_code(code, seed, kwargs, dynprompt, unique_id, budget, prefix)
+                if feedback is None:
+                    metrics.increment("semantic_cache_hits_total")
+                    if VERBOSE:
+                        print(f"Using graph from '{matched_instructions}' for:", instructions)
+                    if cache_key is not None:
+                        graph_cache.put(cache_key, code)
+                    return code, builder, result
+            metrics.increment("semantic_cache_misses_total")
+
+        with metrics.span("catalog"):
+            node_summaries = get_node_summaries()
+            catalog_is_pruned = False
+            if ENABLE_CATALOG_PRUNING and not ENABLE_STABLE_PREFIX:
+                pruned_summaries = node_catalog.pruned_summary(instructions, input_types)
+                metrics.increment("catalog_tokens_saved_estimated_total", estimate_tokens(node_summaries) - estimate_tokens(pruned_summaries))
+                node_summaries = pruned_summaries
+                catalog_is_pruned = True
+        with metrics.span("prompt"):
+            base_messages = build_messages(instructions, input_types, input_names, examples, node_summaries)
+        messages = list(base_messages)
+
+        client = completion_backend
         code = ""
+        # When set, responses are patches to be applied to this code rather than complete programs
+        repair_base = None
+        repair_failing = None
+        def prepare(response):
+            if repair_base is None:
+                return response
+            return apply_patch(repair_base, response, repair_failing)
+
         for _ in range(3):
-            print("Requesting completion from OpenAI:\n\n", messages, "\n\n")
-            completion = client.chat.completions.create(
-                # model="gpt-4-turbo-preview",
-                model="gpt-3.5-turbo",
-                messages=messages
-            )
-            response = completion.choices[0].message
-            code = response.content
-            assert code is not None
-            if "```" in code:
-                code = code.split("```")[1]
-            print("Got response from OpenAI:\n\n", code, "\n\n")
-            # code = test_code
-            if indentation_regex.match(code) is not None:
+            metrics.increment("attempts_total")
+            if VERBOSE:
+                print("Requesting completion from OpenAI:\n\n", messages, "\n\n")
+            usage = None
+            stream_error = None
+            stream_graph_errors = []
+            if NUM_CANDIDATES > 1:
+                with metrics.span("candidates"):
+                    code, builder, result, feedback, graph_errors = first_valid_candidate(
+                        client,
+                        MODEL,
+                        messages,
+                        NUM_CANDIDATES,
+                        seed,
+                        lambda code: check_code(prepare(code), seed, kwargs, dynprompt, unique_id, budget, prefix),
+                        CANDIDATE_MODE,
+                    )
+                record_token_usage(messages, code)
+                code = prepare(code)
+            else:
+                with metrics.span("completion"):
+                    if ENABLE_STREAMING:
+                        code, stream_error, stream_graph_errors = stream_code(client, MODEL, messages, node_catalog.allowed)
+                    else:
+                        completion = client.chat.completions.create(
+                            model=MODEL,
+                            messages=messages
+                        )
+                        response = completion.choices[0].message
+                        assert response.content is not None
+                        code = extract_code(response.content)
+                        usage = getattr(completion, "usage", None)
+                record_token_usage(messages, code, usage)
+                if stream_error is not None:
+                    metrics.increment("failures_total", reason="stream_abort")
+                    builder, result, feedback, graph_errors = None, None, stream_error, stream_graph_errors
+                else:
+                    code = prepare(code)
+                    builder, result, feedback, graph_errors = check_code(code, seed, kwargs, dynprompt, unique_id, budget, prefix)
+            if VERBOSE:
+                print("Got response from OpenAI:\n\n", code, "\n\n")
+            if feedback is not None:
+                if catalog_is_pruned and any(error.kind == UNAVAILABLE_NODE for error in graph_errors):
+                    # The node the model wanted may have been pruned, so show it everything
+                    base_messages[1] = get_catalog_message(get_node_summaries())
+                    messages[1] = base_messages[1]
+                    catalog_is_pruned = False
+                print("Error in generated graph. Trying again:\n", feedback)
+                if ENABLE_TARGETED_REPAIR:
+                    # Only send the latest attempt so that retries don't get slower as they go
+                    failing = {}
+                    if stream_error is None:
+                        failing = get_failing_statements(code, graph_errors, builder)
+                    messages = base_messages + [{"role": "assistant", "content": code}]
+                    if len(failing) > 0:
+                        messages.append({"role": "system", "content": get_repair_prompt(code, failing)})
+                        repair_base = code
+                        repair_failing = set(failing)
+                    else:
+                        messages.append({"role": "system", "content": feedback})
+                        repair_base = None
+                    continue
                 messages.append({"role": "assistant", "content": code})
-                messages.append({"role": "system", "content": f"You must not use any Python flow control (while loops, conditionals, etc.). All your work must be done via the node graph. Fix this issue and try again."})
-                print("Error in generated graph (flow control). Trying again:\n")
+                messages.append({"role": "system", "content": feedback})
                 continue
-            try:
-                objcode = compile(code, "<string>", "exec")
-                result = {}
-                builder = GraphBuilder()
-                generator = random.Random(seed)
-                def rand():
-                    return generator.randint(0, 0xffffffffffffffff)
-
-                locals = {
-                    "g": builder,
-                    "RAND": rand,
-                    "result": result,
-                    **kwargs
-                }
-                globals = {}
-                exec(objcode, globals, locals)
-            except Exception as e:
-                messages.append({"role": "assistant", "content": code})
-                messages.append({"role": "system", "content": f"Your code failed with the following error. Please fix that error and try again. Do not apologize -- just respond with the updated code. Error: {e}"})
-                print("Error in generated graph. Trying again:\n", e)
+            if cache_key is not None:
+                graph_cache.put(cache_key, code)
+            if signature_key is not None:
+                semantic_cache.add(instructions, signature_key, code)
+            return code, builder, result
+
+        metrics.increment("generation_failures_total")
+        raise Exception(f"Failed to generate a valid response: {code}")
+
+class AbracadabraBatchNode(AbracadabraNode):
+    """
+    Generates a graph for each of several instructions, separated by lines of dashes, in a single
+    request so that the catalog and examples are only sent once. The budget applies to each graph.
+
+    The outputs of the graphs are returned one after another in the order of the instructions, e.g.
+    if the first instruction's graph returns two outputs and the second's one, outputs 1 and 2
+    belong to the first instruction and output 3 to the second. More than NUM_OUTPUTS outputs in
+    total is an error, since the extra ones couldn't be connected to anything.
+    """
+    FUNCTION = "do_magic_batch"
+
+    def do_magic_batch(self, instructions, seed, dynprompt, unique_id=None, budget=0.0, **kwargs):
+        instruction_list = split_instructions(instructions)
+        if len(instruction_list) <= 1:
+            return self.do_magic(instructions, seed, dynprompt, unique_id, budget, **kwargs)
+        if len(instruction_list) > self.NUM_OUTPUTS:
+            raise Exception(f"A batch can have at most {self.NUM_OUTPUTS} instructions since each needs at least one of the {self.NUM_OUTPUTS} outputs, but {len(instruction_list)} were given.")
+        metrics.increment("generations_total", len(instruction_list))
+        metrics.observe("batch_size", len(instruction_list))
+        try:
+            with metrics.span("total", batch="true"):
+                builder, result = self.generate_batch(instruction_list, seed, dynprompt, unique_id, budget, kwargs)
+                output = finalize_graph(builder, result, dynprompt, unique_id)
+            metrics.observe("expanded_graph_nodes", len(output["expand"]))
+            return output
+        finally:
+            metrics.export()
+
+    def generate_batch(self, instruction_list, seed, dynprompt, unique_id, budget, kwargs):
+        input_types, input_names = get_input_signature(dynprompt, kwargs)
+        combined_instructions = "\n".join(instruction_list)
+        examples = select_examples(combined_instructions, input_types)
+        node_summaries = get_node_summaries()
+        catalog_is_pruned = False
+        if ENABLE_CATALOG_PRUNING and not ENABLE_STABLE_PREFIX:
+            node_summaries = node_catalog.pruned_summary(combined_instructions, input_types)
+            catalog_is_pruned = True
+        prefix = build_prefix(examples, node_summaries)
+
+        graphs = [None] * len(instruction_list)
+        # Instruction index -> (code, feedback) for the instructions that failed in the last attempt
+        failures = {}
+        for _ in range(3):
+            pending = [i for i, graph in enumerate(graphs) if graph is None]
+            batch_instructions = get_batch_instructions(
+                [instruction_list[i] for i in pending],
+                {pending.index(i): failure for i, failure in failures.items()},
+            )
+            request = build_request(batch_instructions, input_types, input_names)
+            request["content"] += BATCH_FORMAT.format(max_outputs=self.NUM_OUTPUTS)
+            messages = prefix + [request]
+            metrics.increment("attempts_total")
+            if VERBOSE:
+                print("Requesting batch completion from OpenAI:\n\n", messages, "\n\n")
+            with metrics.span("completion", batch="true"):
+                completion = completion_backend.chat.completions.create(model=MODEL, messages=messages)
+            response = completion.choices[0].message
+            assert response.content is not None
+            record_token_usage(messages, response.content, getattr(completion, "usage", None))
+            codes = split_batch_response(response.content, len(pending))
+
+            failures = {}
+            unavailable_node = False
+            for i, code in zip(pending, codes):
+                if code is None:
+                    failures[i] = (None, "Your response did not include code for this instruction.")
+                    continue
+                # Offset the seed so that the graphs don't all get the same random values
+                builder, result, feedback, graph_errors = check_code(code, seed + i, kwargs, dynprompt, unique_id, budget)
+                if feedback is None:
+                    graphs[i] = (builder, result)
+                    continue
+                failures[i] = (code, feedback)
+                unavailable_node = unavailable_node or any(error.kind == UNAVAILABLE_NODE for error in graph_errors)
+            if len(failures) == 0:
+                break
+            if catalog_is_pruned and unavailable_node:
+                prefix = build_prefix(examples, get_node_summaries())
+                catalog_is_pruned = False
+            print(f"Errors in {len(failures)} of {len(pending)} generated graphs. Trying again:\n", [feedback for _, feedback in failures.values()])
+        if len(failures) > 0:
+            metrics.increment("generation_failures_total", len(failures))
+            raise Exception(f"Failed to generate valid graphs for: {[instruction_list[i] for i in failures]}")
+
+        output_counts = [len(result["outputs"]) for _, result in graphs]
+        if sum(output_counts) > self.NUM_OUTPUTS:
+            counts = ", ".join(f"{count} for '{instruction}'" for count, instruction in zip(output_counts, instruction_list))
+            raise Exception(f"The generated graphs return {sum(output_counts)} outputs ({counts}), but there are only {self.NUM_OUTPUTS} outputs. Split the batch or ask for fewer outputs per instruction.")
+        # Each graph has its own node id prefix, so they can be combined without conflicts
+        builder, result = graphs[0]
+        outputs = list(result["outputs"])
+        for other_builder, other_result in graphs[1:]:
+            builder.nodes.update(other_builder.nodes)
+            outputs.extend(other_result["outputs"])
+        return builder, {"outputs": outputs}
+
+def get_prefetch_key(instructions, seed, budget, dynprompt, kwargs):
+    input_types, input_names = get_input_signature(dynprompt, kwargs)
+    return fingerprint({
+        "instructions": instructions,
+        # The prompt's JSON may have e.g. 0 where the executor passes 0.0
+        "seed": int(seed),
+        "budget": float(budget),
+        "input_types": input_types,
+        "input_names": input_names,
+        "catalog": node_catalog.fingerprint,
+        "model": MODEL,
+    })
+
+# Node id prefix for graphs built while prefetching; they are only used to validate the code
+PREFETCH_PREFIX = "abracadabra-prefetch."
+
+def prefetch_code(instructions, seed, dynprompt, unique_id, budget, kwargs):
+    # Allocating a prefix would advance the graph index of whichever node is executing right now
+    code, _, _ = AbracadabraNode().generate(instructions, seed, dynprompt, unique_id, budget, kwargs, prefix=PREFETCH_PREFIX)
+    return code
+
+def prefetch_prompt(json_data):
+    """
+    Prompt handler that starts generating for every Abracadabra node in a newly queued prompt. Only
+    the code is kept, since graphs have to be built on the executing thread to get the right node ids.
+    """
+    try:
+        prompt = json_data["prompt"]
+        dynprompt = DynamicPrompt(prompt)
+        for node_id, node in prompt.items():
+            if node.get("class_type") != "AbracadabraNode":
                 continue
-            errors = get_partial_graph_errors(builder, dynprompt)
-            if errors is not None:
-                messages.append({"role": "assistant", "content": code})
-                messages.append({"role": "system", "content": f"Your code failed to generate a valid graph. Please fix the following errors and try again. Do not apologize -- just respond with the updated code. Errors: {errors}"})
-                print("Error in generated graph. Trying again:\n", errors)
+            inputs = node.get("inputs", {})
+            instructions, seed, budget = inputs.get("instructions"), inputs.get("seed", 0), inputs.get("budget", 0.0)
+            if any(is_link(value) for value in (instructions, seed, budget)):
+                # Only known once upstream nodes have run
                 continue
-            return {
-                "result": tuple(result['outputs']),
-                "expand": builder.finalize(),
-            }
+            kwargs = {k: v for k, v in inputs.items() if k.startswith("input")}
+            key = get_prefetch_key(instructions, seed, budget, dynprompt, kwargs)
+            if prefetcher.submit(key, prefetch_code, instructions, seed, dynprompt, node_id, budget, kwargs):
+                metrics.increment("prefetch_total", result="started")
+    except Exception as e:
+        print("Abracadabra: failed to prefetch generation:", e)
+    return json_data
 
-        raise Exception(f"Failed to generate a valid response: {code}")
+def adopt_prefetched(instructions, seed, dynprompt, unique_id, budget, kwargs):
+    """Returns the (builder, result) for code generated when the prompt was queued, or None."""
+    future = prefetcher.take(get_prefetch_key(instructions, seed, budget, dynprompt, kwargs))
+    if future is None:
+        metrics.increment("prefetch_total", result="missed")
+        return None
+    try:
+        with metrics.span("prefetch_wait"):
+            code = future.result()
+    except Exception as e:
+        metrics.increment("prefetch_total", result="failed")
+        print("Abracadabra: prefetched generation failed, generating again:", e)
+        return None
+    builder, result, feedback, _ = check_code(code, seed, kwargs, dynprompt, unique_id, budget)
+    if feedback is not None:
+        metrics.increment("prefetch_total", result="invalid")
+        return None
+    metrics.increment("prefetch_total", result="adopted")
+    return builder, result
+
+def register_prefetch():
+    if not ENABLE_PREFETCH:
+        return
+    try:
+        import server
+        server.PromptServer.instance.add_on_prompt_handler(prefetch_prompt)
+    except Exception as e:
+        print("Abracadabra: could not register the prefetch handler:", e)
 
 NODE_CLASS_MAPPINGS = {
     "AbracadabraNodeDefSummary": AbracadabraNodeDefSummary,
     "AbracadabraNode": AbracadabraNode,
+    "AbracadabraBatchNode": AbracadabraBatchNode,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "AbracadabraNodeDefSummary": "Abracadabra Summary",
     "AbracadabraNode": "Abracadabra",
+    "AbracadabraBatchNode": "Abracadabra (Batch)",
 }
@@ -0,0 +1,160 @@
+import nodes
+from comfy.graph_utils import GraphBuilder, is_link
+from comfy.graph import DynamicPrompt
+
+def freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(x) for x in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    return value
+
+def is_pure(class_type):
+    cls = nodes.NODE_CLASS_MAPPINGS.get(class_type)
+    if cls is None:
+        return False
+    # ComfyUI itself never treats NOT_IDEMPOTENT nodes with the same inputs as one node
+    return (
+        not hasattr(cls, "IS_CHANGED")
+        and not getattr(cls, "OUTPUT_NODE", False)
+        and not getattr(cls, "NOT_IDEMPOTENT", False)
+    )
+
+def is_output_node(class_type):
+    cls = nodes.NODE_CLASS_MAPPINGS.get(class_type)
+    return cls is None or getattr(cls, "OUTPUT_NODE", False)
+
+def get_topological_order(graph: GraphBuilder):
+    order = []
+    visited = set()
+    for node_id in graph.nodes:
+        stack = [(node_id, False)]
+        while len(stack) > 0:
+            current, expanded = stack.pop()
+            if expanded:
+                order.append(current)
+                continue
+            if current in visited:
+                continue
+            visited.add(current)
+            stack.append((current, True))
+            for value in graph.nodes[current].inputs.values():
+                if is_link(value) and value[0] in graph.nodes and value[0] not in visited:
+                    stack.append((value[0], False))
+    return order
+
+def rewire(value, replacements):
+    if is_link(value) and value[0] in replacements:
+        return [replacements[value[0]], value[1]]
+    return value
+
+def merge_duplicates(graph: GraphBuilder, result):
+    """
+    Merges nodes with the same class and the same inputs (after merging their inputs' sources)
+    into the first of them and returns the class types of the removed nodes. Nodes that may have
+    side effects or depend on outside state, i.e. output nodes and nodes with IS_CHANGED, are
+    never merged.
+    """
+    replacements = {}
+    seen = {}
+    for node_id in get_topological_order(graph):
+        node = graph.nodes[node_id]
+        for key, value in node.inputs.items():
+            node.inputs[key] = rewire(value, replacements)
+        if not is_pure(node.class_type):
+            continue
+        signature = (node.class_type, freeze(node.inputs))
+        if signature in seen:
+            replacements[node_id] = seen[signature]
+        else:
+            seen[signature] = node_id
+    result["outputs"] = [rewire(value, replacements) for value in result["outputs"]]
+    return [graph.nodes.pop(node_id).class_type for node_id in replacements]
+
+def get_existing_node_ids(existing_graph: DynamicPrompt):
+    if hasattr(existing_graph, "all_node_ids"):
+        return existing_graph.all_node_ids()
+    return existing_graph.original_prompt.keys()
+
+def get_dependents(existing_graph: DynamicPrompt, node_ids, node_id):
+    """Returns the ids of the nodes in the existing graph that depend on `node_id`, including itself."""
+    consumers = {}
+    for other_id in node_ids:
+        for value in existing_graph.get_node(other_id).get("inputs", {}).values():
+            if is_link(value):
+                consumers.setdefault(value[0], []).append(other_id)
+    dependents = set()
+    stack = [node_id]
+    while len(stack) > 0:
+        current = stack.pop()
+        if current in dependents:
+            continue
+        dependents.add(current)
+        stack.extend(consumers.get(current, []))
+    return dependents
+
+def reuse_existing_nodes(graph: GraphBuilder, result, existing_graph: DynamicPrompt, unique_id):
+    """
+    Replaces nodes in the graph with identical nodes that already exist in the enclosing workflow,
+    so that e.g. a checkpoint that the workflow loads isn't loaded a second time. Nodes that
+    depend on `unique_id` (the node being expanded) are never reused since that would create a
+    cycle, and neither are nodes that aren't pure on either side, such as NOT_IDEMPOTENT ones.
+    Returns the class types of the removed nodes.
+    """
+    node_ids = [x for x in get_existing_node_ids(existing_graph) if x not in graph.nodes]
+    excluded = get_dependents(existing_graph, node_ids, unique_id) if unique_id is not None else set()
+    existing = {}
+    for existing_id in sorted(node_ids):
+        if existing_id in excluded:
+            continue
+        existing_node = existing_graph.get_node(existing_id)
+        if not is_pure(existing_node["class_type"]):
+            continue
+        signature = (existing_node["class_type"], freeze(existing_node.get("inputs", {})))
+        existing.setdefault(signature, existing_id)
+    if len(existing) == 0:
+        return []
+    replacements = {}
+    for node_id in get_topological_order(graph):
+        node = graph.nodes[node_id]
+        for key, value in node.inputs.items():
+            node.inputs[key] = rewire(value, replacements)
+        if not is_pure(node.class_type):
+            continue
+        # Only nodes whose inputs are all constants or links into the existing workflow can match
+        if any(is_link(value) and value[0] in graph.nodes for value in node.inputs.values()):
+            continue
+        signature = (node.class_type, freeze(node.inputs))
+        if signature in existing:
+            replacements[node_id] = existing[signature]
+    result["outputs"] = [rewire(value, replacements) for value in result["outputs"]]
+    return [graph.nodes.pop(node_id).class_type for node_id in replacements]
+
+def remove_dead_nodes(graph: GraphBuilder, result):
+    """Removes nodes that neither the outputs nor any output node depend on. Returns their class types."""
+    stack = [value[0] for value in result["outputs"] if is_link(value)]
+    stack.extend(node_id for node_id, node in graph.nodes.items() if is_output_node(node.class_type))
+    reachable = set()
+    while len(stack) > 0:
+        node_id = stack.pop()
+        if node_id in reachable or node_id not in graph.nodes:
+            continue
+        reachable.add(node_id)
+        for value in graph.nodes[node_id].inputs.values():
+            if is_link(value):
+                stack.append(value[0])
+    dead = [node_id for node_id in graph.nodes if node_id not in reachable]
+    return [graph.nodes.pop(node_id).class_type for node_id in dead]
+
+def optimize_graph(graph: GraphBuilder, result, existing_graph: DynamicPrompt | None = None, unique_id=None):
+    """
+    Removes duplicate and unused nodes from the graph in place, rewiring links and the result's
+    outputs. When the enclosing workflow is given, nodes it already contains are linked to rather
+    than duplicated. Returns the class types of the removed nodes by reason ("merged", "reused" or
+    "dead").
+    """
+    removed = {"merged": merge_duplicates(graph, result)}
+    if existing_graph is not None:
+        removed["reused"] = reuse_existing_nodes(graph, result, existing_graph, unique_id)
+    removed["dead"] = remove_dead_nodes(graph, result)
+    return removed
@@ -0,0 +1,151 @@
+import ast
+import traceback
+
+def get_exception_lineno(e: BaseException):
+    """Returns the line of the generated code that raised `e`, if it can be determined."""
+    if isinstance(e, SyntaxError):
+        return e.lineno
+    lineno = None
+    for frame in traceback.extract_tb(e.__traceback__):
+        if frame.filename == "<string>":
+            lineno = frame.lineno
+    return lineno
+
+def is_node_call(node):
+    return (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Attribute)
+        and node.func.attr == "node"
+        and isinstance(node.func.value, ast.Name)
+        and node.func.value.id == "g"
+    )
+
+def get_statement_target(statement):
+    """Returns the name a statement assigns to, which is how patches are matched to statements."""
+    if isinstance(statement, ast.Assign) and len(statement.targets) == 1:
+        target = statement.targets[0]
+        if isinstance(target, ast.Name):
+            return target.id
+        if isinstance(target, ast.Subscript) and isinstance(target.value, ast.Name):
+            return ast.unparse(target)
+    return None
+
+def get_failing_statements(code, graph_errors, builder) -> dict[int, list[str]]:
+    """
+    Maps the index of each top-level statement that caused an error to the messages of its
+    errors. Errors are placed by their line number. Errors without one are attributed to
+    statements by the order in which their node was created, which matches the source order when
+    the code was executed, since execution stops at the first statement that fails.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        tree = None
+    if tree is None:
+        return {}
+    node_statements = []
+    for index, statement in enumerate(tree.body):
+        node_statements.extend([index] * sum(1 for node in ast.walk(statement) if is_node_call(node)))
+    failing = {}
+    for error in graph_errors:
+        index = None
+        if error.lineno is not None:
+            for i, statement in enumerate(tree.body):
+                if statement.lineno <= error.lineno <= (statement.end_lineno or statement.lineno):
+                    index = i
+        elif error.node_id is not None and builder is not None and error.node_id.startswith(builder.prefix):
+            suffix = error.node_id[len(builder.prefix):]
+            if suffix.isdigit() and 0 < int(suffix) <= len(node_statements):
+                index = node_statements[int(suffix) - 1]
+        if index is None:
+            # One error we can't place means the whole program needs another look
+            return {}
+        failing.setdefault(index, []).append(str(error))
+    return failing
+
+def get_repair_prompt(code, failing):
+    statements = ast.parse(code).body
+    prompt = "The code above has errors in the following statements:\n\n"
+    for index, errors in sorted(failing.items()):
+        prompt += f"```\n{ast.get_source_segment(code, statements[index])}\n```\n"
+        for error in errors:
+            prompt += f"- {error}\n"
+        prompt += "\n"
+    prompt += "Respond only with corrected versions of these statements, plus any new statements they need. Keep the same variable names so that the fixes can be patched into the code. To remove a statement, respond with `del <variable>` for the variable it assigns to. Do not apologize."
+    return prompt
+
+def is_outputs_statement(statement):
+    return (get_statement_target(statement) or "").startswith("result")
+
+def get_free_names(statements):
+    """Names that `statements` read without assigning them."""
+    loaded = set()
+    stored = set()
+    for statement in statements:
+        for node in ast.walk(statement):
+            if isinstance(node, ast.Name):
+                (loaded if isinstance(node.ctx, ast.Load) else stored).add(node.id)
+    return loaded - stored
+
+def apply_patch(code, patch, failing=None):
+    """
+    Patches the statements in `patch` into `code`, replacing statements that assign to the same
+    name and removing those named by `del` statements. New statements are inserted before the
+    first replaced statement, or before the outputs are set if nothing was replaced.
+
+    `patch` is instead taken to be a complete replacement if either side can't be parsed, or if it
+    defines every name it uses and either replaces most of the statements in `code`, including
+    some that aren't among the `failing` statement indices that the repair prompt asked about, or
+    changes the outputs although the outputs statement isn't one of the failing ones.
+    """
+    try:
+        statements = ast.parse(code).body
+        patch_statements = ast.parse(patch).body
+    except SyntaxError:
+        return patch
+    targets = {}
+    for index, statement in enumerate(statements):
+        target = get_statement_target(statement)
+        if target is not None:
+            targets[target] = index
+    # A whole program can't depend on variables of the code it replaces
+    if len(get_free_names(patch_statements) & set(targets)) == 0:
+        covered = set(targets[target] for target in (get_statement_target(s) for s in patch_statements) if target in targets)
+        # Patches only repeat the statements they fix, so repeating others means it's a whole program
+        if len(covered) > len(targets) / 2 and (failing is None or not covered <= set(failing)):
+            return patch
+        base_outputs = [ast.dump(statement) for statement in statements if is_outputs_statement(statement)]
+        # Repeating the outputs unchanged is common in patches, so only changed outputs count
+        changes_outputs = any(is_outputs_statement(statement) and ast.dump(statement) not in base_outputs for statement in patch_statements)
+        if failing is not None and changes_outputs:
+            if not any(is_outputs_statement(statements[index]) for index in failing if index < len(statements)):
+                return patch
+    replacements = {}
+    deletions = set()
+    inserts = []
+    for statement in patch_statements:
+        if isinstance(statement, ast.Delete):
+            names = [target.id for target in statement.targets if isinstance(target, ast.Name)]
+            if len(names) == len(statement.targets) and all(name in targets for name in names):
+                deletions.update(targets[name] for name in names)
+                continue
+        source = ast.get_source_segment(patch, statement)
+        index = targets.get(get_statement_target(statement))
+        if index is not None:
+            replacements[index] = source
+        else:
+            inserts.append(source)
+    if len(replacements) > 0:
+        insert_at = min(replacements)
+    else:
+        insert_at = next((i for i, s in enumerate(statements) if is_outputs_statement(s)), len(statements))
+    lines = []
+    for index, statement in enumerate(statements):
+        if index == insert_at:
+            lines.extend(inserts)
+        if index in deletions and index not in replacements:
+            continue
+        lines.append(replacements.get(index, ast.get_source_segment(code, statement)))
+    if insert_at >= len(statements):
+        lines.extend(inserts)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,45 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+MAX_PREFETCH_WORKERS = 4
+# Prefetched results that haven't been used after this many seconds are dropped
+PREFETCH_TTL = 30 * 60
+
+class Prefetcher:
+    """
+    Runs work in the background ahead of when it's needed, keyed by everything the result
+    depends on. A caller that later needs the result for the same key takes the future and waits
+    for it; results whose key never comes up (e.g. because the inputs changed) expire.
+    """
+    def __init__(self, max_workers=MAX_PREFETCH_WORKERS, ttl=PREFETCH_TTL):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="abracadabra-prefetch")
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.pending: dict[str, tuple[float, Future]] = {}
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [key for key, (submitted, _) in self.pending.items() if now - submitted > self.ttl]:
+            del self.pending[key]
+
+    def submit(self, key, fn, *args):
+        """Starts `fn(*args)` in the background unless the same key is already pending."""
+        with self.lock:
+            self._expire()
+            if key in self.pending:
+                return False
+            self.pending[key] = (time.monotonic(), self.executor.submit(fn, *args))
+            return True
+
+    def take(self, key) -> Future | None:
+        with self.lock:
+            self._expire()
+            entry = self.pending.pop(key, None)
+        return entry[1] if entry is not None else None
+
+    def stats(self):
+        with self.lock:
+            return {"pending": len(self.pending)}
+
+prefetcher = Prefetcher()
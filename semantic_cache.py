@@ -0,0 +1,130 @@
+import json
+import os
+import re
+import threading
+from .cache import CACHE_DIR, fingerprint
+
+SEMANTIC_CACHE_FILE = os.path.join(CACHE_DIR, "semantic_index.jsonl")
+SEMANTIC_CACHE_MAX_ENTRIES = 10000
+
+word_regex = re.compile(r"[a-z0-9]+")
+# Words that can differ between rewordings without changing what is asked for
+FUNCTION_WORDS = frozenset("""
+a an the this that these those it its all any some each every of in on at to from into onto out
+with without by for and or as is are be please my me i you your can could would should then so
+""".split())
+
+def get_content_words(text):
+    """
+    The instruction's content words (nouns, verbs, numbers, ...) in order, lowercased and without
+    punctuation. Order is kept since "dogs with beavers" and "beavers with dogs" ask for different
+    graphs.
+    """
+    return [word for word in word_regex.findall(text.lower()) if word not in FUNCTION_WORDS]
+
+def get_signature_key(input_types, input_names, catalog_fingerprint, model, prompt_version) -> str:
+    """Entries are only reused for identical inputs, nodes, model and prompt."""
+    return fingerprint({
+        "input_types": input_types,
+        "input_names": input_names,
+        "catalog": catalog_fingerprint,
+        "model": model,
+        "prompt_version": prompt_version,
+    })
+
+class SemanticCache:
+    """
+    Code from successful generations, keyed by the input signature and the content words of the
+    instruction. Instructions that only differ in case, punctuation and function words ("Remove
+    the cars.", "please remove all the cars", "remove cars") share an entry. Synonyms ("photoshop
+    out the cars") don't, since telling them apart from different requests needs a real model.
+    """
+    def __init__(self, path=SEMANTIC_CACHE_FILE, max_entries=SEMANTIC_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.loaded = False
+        # Oldest first, so eviction drops entries from the front
+        self.entries: dict[tuple, dict] = {}
+        self.lines = 0
+
+    @staticmethod
+    def _key(instruction, signature):
+        content_words = get_content_words(instruction)
+        if len(content_words) == 0:
+            return None
+        return (signature, tuple(content_words))
+
+    def _insert(self, key, entry):
+        self.entries.pop(key, None)
+        self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+
+    def _ensure_loaded(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as f:
+            lines = f.readlines()
+        self.lines = len(lines)
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            key = self._key(entry["instruction"], entry["signature"])
+            if key is not None:
+                self._insert(key, entry)
+
+    def lookup(self, instruction, signature):
+        """Returns (stored instruction, code) for an entry with the same content words, or None."""
+        key = self._key(instruction, signature)
+        if key is None:
+            return None
+        with self.lock:
+            self._ensure_loaded()
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return entry["instruction"], entry["code"]
+
+    def add(self, instruction, signature, code):
+        key = self._key(instruction, signature)
+        if key is None:
+            return
+        entry = {"instruction": instruction, "signature": signature, "code": code}
+        with self.lock:
+            self._ensure_loaded()
+            self._insert(key, entry)
+            # The entry stays usable in memory even if it can't be persisted
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                if self.lines >= self.max_entries:
+                    self._compact()
+                else:
+                    with open(self.path, "a") as f:
+                        f.write(json.dumps(entry) + "\n")
+                    self.lines += 1
+            except OSError as e:
+                print("Abracadabra: could not write to the semantic cache:", e)
+
+    def _compact(self):
+        # Other processes may share the cache directory
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(tmp_path, self.path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self.lines = len(self.entries)
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,207 @@
+import ast
+import operator
+import random
+from comfy.graph_utils import GraphBuilder, is_link
+from .validation import GraphError
+
+FLOW_CONTROL = "flow_control"
+UNSUPPORTED_CODE = "unsupported_code"
+
+FLOW_CONTROL_STATEMENTS = (
+    ast.For, ast.AsyncFor, ast.While, ast.If, ast.With, ast.AsyncWith, ast.Try,
+    ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Match, ast.Break, ast.Continue, ast.Return,
+)
+FLOW_CONTROL_EXPRESSIONS = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp, ast.IfExp, ast.Lambda)
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+
+class InvalidExpression(Exception):
+    """Raised once an error has been recorded so evaluation of the current value stops."""
+
+class StaticGraphBuilder:
+    """
+    Builds the node graph described by generated code by interpreting its syntax tree instead
+    of executing it. Only a whitelist of forms is understood: `g.node(...)` calls, `.out(i)`,
+    `RAND()`, constants and simple arithmetic on them, the provided inputs, and assignments to
+    variables and `result['outputs']`. Every problem is recorded rather than stopping at the first.
+    """
+    def __init__(self, seed, inputs, prefix=None):
+        self.builder = GraphBuilder(prefix)
+        self.generator = random.Random(seed)
+        self.inputs = inputs
+        self.variables = {}
+        # Variables whose value couldn't be computed; uses of them have already been reported
+        self.poisoned = set()
+        self.created = set()
+        self.result = {}
+        self.sets_outputs = False
+        self.errors: list[GraphError] = []
+        # (node_id, input_name) pairs that were dropped because their value was invalid
+        self.failed_inputs = set()
+        # Line of the g.node() call that created each node, for attributing validation errors
+        self.node_lines: dict[str, int] = {}
+
+    def error(self, kind, message, node):
+        self.errors.append(GraphError(kind, f"Line {node.lineno}: {message}", lineno=node.lineno))
+        raise InvalidExpression()
+
+    def build(self, code):
+        try:
+            tree = ast.parse(code)
+        except SyntaxError as e:
+            self.errors.append(GraphError(UNSUPPORTED_CODE, f"Line {e.lineno}: Syntax error: {e.msg}", lineno=e.lineno))
+            return self
+        for statement in tree.body:
+            try:
+                self.statement(statement)
+            except InvalidExpression:
+                pass
+            except Exception as e:
+                # Anything the checks above missed is still the generated code's fault
+                self.errors.append(GraphError(UNSUPPORTED_CODE, f"Line {statement.lineno}: {type(e).__name__}: {e}", lineno=statement.lineno))
+        if not self.sets_outputs:
+            self.errors.append(GraphError(UNSUPPORTED_CODE, "result['outputs'] was never set."))
+        return self
+
+    def statement(self, statement):
+        if isinstance(statement, FLOW_CONTROL_STATEMENTS):
+            self.error(FLOW_CONTROL, "Python flow control (loops, conditionals, functions, etc.) is not allowed. All your work must be done via the node graph.", statement)
+        if isinstance(statement, ast.Expr):
+            if isinstance(statement.value, ast.Constant) and isinstance(statement.value.value, str):
+                return
+            self.value(statement.value)
+            return
+        if isinstance(statement, ast.Assign) and len(statement.targets) == 1:
+            target = statement.targets[0]
+            if isinstance(target, ast.Name):
+                if target.id in ("g", "RAND", "result"):
+                    self.error(UNSUPPORTED_CODE, f"'{target.id}' must not be reassigned.", statement)
+                try:
+                    self.variables[target.id] = self.value(statement.value)
+                    self.poisoned.discard(target.id)
+                except InvalidExpression:
+                    self.poisoned.add(target.id)
+                    raise
+                return
+            if (
+                isinstance(target, ast.Subscript)
+                and isinstance(target.value, ast.Name)
+                and target.value.id == "result"
+                and isinstance(target.slice, ast.Constant)
+                and target.slice.value == "outputs"
+            ):
+                self.sets_outputs = True
+                if not isinstance(statement.value, (ast.List, ast.Tuple)):
+                    self.error(UNSUPPORTED_CODE, "result['outputs'] must be set to a list.", statement)
+                outputs = self.value(statement.value)
+                for i, output in enumerate(outputs):
+                    if not is_link(output) and not isinstance(output, (str, int, float, bool)):
+                        self.error(UNSUPPORTED_CODE, f"Output {i} in result['outputs'] must be a node output such as `node.out(0)` or a constant.", statement)
+                self.result["outputs"] = outputs
+                return
+        if isinstance(statement, (ast.Import, ast.ImportFrom)):
+            self.error(UNSUPPORTED_CODE, "Imports are not allowed.", statement)
+        self.error(UNSUPPORTED_CODE, f"Unsupported statement `{ast.unparse(statement)}`. Only assign the results of g.node(...) calls to variables and set result['outputs'].", statement)
+
+    def value(self, node):
+        if isinstance(node, FLOW_CONTROL_EXPRESSIONS):
+            self.error(FLOW_CONTROL, "Comprehensions, conditional expressions and lambdas are not allowed. All your work must be done via the node graph.", node)
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            operand = self.value(node.operand)
+            if not isinstance(operand, (int, float)):
+                self.error(UNSUPPORTED_CODE, "Unary operators can only be used on numbers.", node)
+            return -operand if isinstance(node.op, ast.USub) else operand
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            left = self.value(node.left)
+            right = self.value(node.right)
+            if not isinstance(left, (int, float)) or not isinstance(right, (int, float)):
+                self.error(UNSUPPORTED_CODE, "Arithmetic can only be done on numbers. Use nodes to work with other values.", node)
+            try:
+                return BINARY_OPERATORS[type(node.op)](left, right)
+            except ArithmeticError as e:
+                self.error(UNSUPPORTED_CODE, f"Invalid arithmetic: {e}", node)
+        if isinstance(node, (ast.List, ast.Tuple)):
+            return [self.value(element) for element in node.elts]
+        if isinstance(node, ast.Name):
+            return self.name(node)
+        if isinstance(node, ast.Call):
+            return self.call(node)
+        self.error(UNSUPPORTED_CODE, f"Unsupported expression `{ast.unparse(node)}`.", node)
+
+    def name(self, node: ast.Name):
+        if node.id in self.poisoned:
+            raise InvalidExpression()
+        if node.id in self.variables:
+            return self.variables[node.id]
+        if node.id in self.inputs:
+            return self.inputs[node.id]
+        self.error(UNSUPPORTED_CODE, f"Unknown name '{node.id}'.", node)
+
+    def call(self, node: ast.Call):
+        func = node.func
+        if isinstance(func, ast.Name) and func.id == "RAND":
+            if len(node.args) > 0 or len(node.keywords) > 0:
+                self.error(UNSUPPORTED_CODE, "RAND() does not take any arguments.", node)
+            return self.generator.randint(0, 0xffffffffffffffff)
+        if isinstance(func, ast.Attribute):
+            if isinstance(func.value, ast.Name) and func.value.id == "g" and func.attr == "node":
+                return self.create_node(node)
+            if func.attr == "out":
+                # Also allows chained calls like g.node(...).out(0)
+                target = self.value(func.value)
+                if id(target) not in self.created:
+                    self.error(UNSUPPORTED_CODE, f"'{ast.unparse(func.value)}' is not a node, so it has no outputs.", node)
+                if len(node.args) != 1 or len(node.keywords) > 0:
+                    self.error(UNSUPPORTED_CODE, ".out() takes exactly one output index.", node)
+                index = self.value(node.args[0])
+                if not isinstance(index, int) or isinstance(index, bool):
+                    self.error(UNSUPPORTED_CODE, "Output indices must be integers.", node)
+                return target.out(index)
+        self.error(UNSUPPORTED_CODE, f"Unsupported call `{ast.unparse(node)}`. Only g.node(...), node.out(i) and RAND() may be called.", node)
+
+    def create_node(self, node: ast.Call):
+        if len(node.args) != 1:
+            self.error(UNSUPPORTED_CODE, "g.node() takes the node type as its only positional argument.", node)
+        class_type = self.value(node.args[0])
+        if not isinstance(class_type, str):
+            self.error(UNSUPPORTED_CODE, "The node type passed to g.node() must be a string.", node)
+        inputs = {}
+        failed = []
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                self.errors.append(GraphError(UNSUPPORTED_CODE, f"Line {keyword.lineno}: Unpacking (**) is not allowed in g.node().", lineno=keyword.lineno))
+                continue
+            try:
+                value = self.value(keyword.value)
+                if id(value) in self.created:
+                    self.errors.append(GraphError(UNSUPPORTED_CODE, f"Line {keyword.lineno}: Input '{keyword.arg}' is set to a node. Use `.out(i)` to link one of its outputs.", lineno=keyword.lineno))
+                    raise InvalidExpression()
+                inputs[keyword.arg] = value
+            except InvalidExpression:
+                failed.append(keyword.arg)
+        node_id = inputs.pop("id", None)
+        if node_id is not None and not isinstance(node_id, str):
+            self.error(UNSUPPORTED_CODE, "The id passed to g.node() must be a string.", node)
+        created = self.builder.node(class_type, id=node_id, **inputs)
+        self.created.add(id(created))
+        self.node_lines.setdefault(created.id, node.lineno)
+        for input_name in failed:
+            self.failed_inputs.add((created.id, input_name))
+        return created
+
+def build_static_graph(code, seed, inputs, prefix=None):
+    """
+    Returns the builder, the result dict, the errors found in the code, the set of
+    (node_id, input_name) pairs that were left out because their values were invalid and the
+    line that created each node.
+    """
+    static_builder = StaticGraphBuilder(seed, inputs, prefix).build(code)
+    return static_builder.builder, static_builder.result, static_builder.errors, static_builder.failed_inputs, static_builder.node_lines
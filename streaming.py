@@ -0,0 +1,150 @@
+import ast
+import io
+import re
+import tokenize
+from .validation import UNAVAILABLE_NODE, GraphError
+
+fence = "```"
+FLOW_CONTROL_KEYWORDS = frozenset(["for", "while", "if", "elif", "else", "try", "except", "finally", "with", "def", "class", "async", "match"])
+DISALLOWED_STATEMENTS = frozenset(["import", "from", "global", "nonlocal"])
+DISALLOWED_CALLS = frozenset(["exec", "eval", "open", "compile", "__import__"])
+dunder_regex = re.compile(r"^__\w+__$")
+IGNORED_TOKENS = frozenset([tokenize.NL, tokenize.NEWLINE, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER])
+
+FLOW_CONTROL_ERROR = "You must not use any Python flow control (while loops, conditionals, etc.). All your work must be done via the node graph. Fix this issue and try again."
+
+def extract_code(text):
+    """Returns the contents of the first code fence in `text`, or all of `text` if there is none."""
+    if fence not in text:
+        return text
+    code = text.split(fence)[1]
+    first_line, _, rest = code.partition("\n")
+    if first_line.strip().isidentifier():
+        # Drop the language tag, e.g. ```python
+        return rest
+    return code
+
+class CodeStreamChecker:
+    """
+    Consumes a completion as it streams in and decides as early as possible whether to keep
+    going. `error` is set as soon as the code is known to be invalid, and `complete` is set
+    once the closing code fence arrives so that trailing prose doesn't have to be generated.
+    """
+    def __init__(self, available_nodes):
+        self.available_nodes = available_nodes
+        self.text = ""
+        self.checked_lines = 0
+        self.fences = 0
+        self.error = None
+        self.graph_errors: list[GraphError] = []
+        self.complete = False
+        # Lines of a statement or string that continues on the next line
+        self.pending = []
+        self.pending_is_first = False
+
+    @property
+    def code(self):
+        return extract_code(self.text)
+
+    def feed(self, delta):
+        self.text += delta
+        fences = self.text.count(fence)
+        if fences > 0 and self.fences == 0:
+            # Anything before the opening fence was prose, so the code starts over from here
+            self.checked_lines = 0
+            self.pending = []
+        self.fences = fences
+        if fences >= 2:
+            self.complete = True
+        if fences == 0 and not self.looks_like_code():
+            return
+        if fences == 1 and "\n" not in self.text.split(fence, 1)[1]:
+            # The language tag may still be arriving
+            return
+        # Only whole lines are checked; the last one may still be growing
+        lines = self.code.split("\n")
+        if not self.complete:
+            lines = lines[:-1]
+        for line in lines[self.checked_lines:]:
+            self.check_line(line, self.checked_lines == 0)
+            self.checked_lines += 1
+            if self.error is not None:
+                return
+
+    def looks_like_code(self):
+        for line in self.text.split("\n")[:-1]:
+            if len(line.strip()) > 0:
+                return "=" in line or line.lstrip().startswith(("#", "g.", "result"))
+        return False
+
+    def check_line(self, line, is_first):
+        if len(self.pending) == 0:
+            self.pending_is_first = is_first
+        self.pending.append(line)
+        source = "\n".join(self.pending) + "\n"
+        try:
+            tokens = list(tokenize.generate_tokens(io.StringIO(source).readline))
+        except (tokenize.TokenError, SyntaxError):
+            # The statement or string continues on the next line. Code that never tokenizes is
+            # left for the full check once it's complete.
+            return
+        self.pending = []
+        self.check_statement(source, tokens, self.pending_is_first)
+
+    def check_statement(self, source, tokens, is_first):
+        tokens = [token for token in tokens if token.type not in IGNORED_TOKENS]
+        if len(tokens) == 0:
+            return
+        stripped = source.strip()
+        first = tokens[0]
+        if (is_first and source[0].isspace()) or (first.type == tokenize.NAME and first.string in FLOW_CONTROL_KEYWORDS):
+            self.error = FLOW_CONTROL_ERROR
+            return
+        for i, token in enumerate(tokens):
+            # Only names are checked, so the contents of strings and comments are ignored
+            if token.type != tokenize.NAME:
+                continue
+            following = tokens[i + 1].string if i + 1 < len(tokens) else None
+            if (
+                (i == 0 and token.string in DISALLOWED_STATEMENTS)
+                or (token.string in DISALLOWED_CALLS and following == "(")
+                or dunder_regex.match(token.string) is not None
+            ):
+                self.error = f"Your code used a disallowed construct in `{stripped}`. Only create nodes with `g.node`, link them with `.out(i)` and set `result['outputs']`. Fix this issue and try again."
+                return
+            if token.string == "g" and [t.string for t in tokens[i + 1:i + 4]] == [".", "node", "("] and i + 4 < len(tokens) and tokens[i + 4].type == tokenize.STRING:
+                try:
+                    class_type = ast.literal_eval(tokens[i + 4].string)
+                except (ValueError, SyntaxError):
+                    continue
+                if isinstance(class_type, str) and class_type not in self.available_nodes:
+                    message = f"Node type '{class_type}' is not available in this environment."
+                    self.graph_errors.append(GraphError(UNAVAILABLE_NODE, message, class_type=class_type))
+                    self.error = f"{message} Only use the nodes listed above. Fix this issue and try again."
+                    return
+
+def stream_code(client, model, messages, available_nodes):
+    """
+    Requests a completion with streaming enabled and stops reading it as soon as the code is
+    known to be invalid or complete. Returns the (possibly partial) code, an error message, which
+    is None if nothing was wrong with the code, and the GraphErrors behind the message if any.
+    """
+    checker = CodeStreamChecker(available_nodes)
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+    )
+    try:
+        for chunk in stream:
+            if len(chunk.choices) == 0:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                checker.feed(delta)
+            if checker.error is not None or checker.complete:
+                break
+    finally:
+        # Closing the response cancels the rest of the generation
+        stream.close()
+    return checker.code, checker.error, checker.graph_errors
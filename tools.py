@@ -1,25 +1,63 @@
-
 class SmartType(str):
+    """
+    A type name that compares as "not equal" only when none of its comma-separated variants
+    are compatible. Instances are interned and comparison results are cached, since ComfyUI
+    compares the same handful of types over and over during validation.
+    """
+    _interned = {}
+    _comparisons = {}
+
+    def __new__(cls, value):
+        if not isinstance(value, str):
+            value = str(value)
+        existing = cls._interned.get(value)
+        if existing is not None:
+            return existing
+        instance = super().__new__(cls, value)
+        instance.variants = frozenset(value.split(','))
+        cls._interned[str(instance)] = instance
+        return instance
+
     def __ne__(self, other):
+        if not isinstance(other, str):
+            return super().__ne__(other)
         if self == "*" or other == "*":
             return False
-        selfset = set(self.split(','))
-        otherset = set(other.split(','))
-        return not selfset.issubset(otherset)
+        key = (self, other)
+        result = SmartType._comparisons.get(key)
+        if result is None:
+            other_variants = other.variants if isinstance(other, SmartType) else frozenset(other.split(','))
+            result = not self.variants.issubset(other_variants)
+            SmartType._comparisons[key] = result
+        return result
+
+# Bumped by invalidate_input_types to discard every memoized INPUT_TYPES result
+input_types_generation = 0
+
+def invalidate_input_types():
+    global input_types_generation
+    input_types_generation += 1
 
 def VariantSupport():
     def decorator(cls):
         if hasattr(cls, "INPUT_TYPES"):
             old_input_types = getattr(cls, "INPUT_TYPES")
+            cache = {}
             def new_input_types(*args, **kwargs):
-                types = old_input_types(*args, **kwargs)
-                for category in ["required", "optional"]:
-                    if category not in types:
-                        continue
-                    for key, value in types[category].items():
-                        if isinstance(value, tuple):
-                            types[category][key] = (SmartType(value[0]),) + value[1:]
-                return types
+                key = (args, tuple(sorted(kwargs.items())))
+                cached = cache.get(key)
+                if cached is None or cached[0] != input_types_generation:
+                    types = old_input_types(*args, **kwargs)
+                    for category in ["required", "optional"]:
+                        if category not in types:
+                            continue
+                        for key_name, value in types[category].items():
+                            if isinstance(value, tuple):
+                                types[category][key_name] = (SmartType(value[0]),) + value[1:]
+                    cached = (input_types_generation, types)
+                    cache[key] = cached
+                # Copy the containers so callers can't modify the memoized result
+                return {category: dict(value) if isinstance(value, dict) else value for category, value in cached[1].items()}
             setattr(cls, "INPUT_TYPES", new_input_types)
         if hasattr(cls, "RETURN_TYPES"):
             old_return_types = cls.RETURN_TYPES
@@ -28,21 +66,26 @@ def VariantSupport():
             # Reflection is used to determine what the function signature is, so we can't just change the function signature
             raise NotImplementedError("VariantSupport does not support VALIDATE_INPUTS yet")
         else:
+            expected_types = [None, {}]
+            def get_expected_types():
+                if expected_types[0] != input_types_generation:
+                    inputs = cls.INPUT_TYPES()
+                    expected = {}
+                    for category in ["optional", "required"]:
+                        for key, value in inputs.get(category, {}).items():
+                            expected[key] = value[0]
+                    expected_types[0] = input_types_generation
+                    expected_types[1] = expected
+                return expected_types[1]
             def validate_inputs(input_types):
-                inputs = cls.INPUT_TYPES()
+                expected = get_expected_types()
                 for key, value in input_types.items():
                     if isinstance(value, SmartType):
                         continue
-                    if "required" in inputs and key in inputs["required"]:
-                        expected_type = inputs["required"][key][0]
-                    elif "optional" in inputs and key in inputs["optional"]:
-                        expected_type = inputs["optional"][key][0]
-                    else:
-                        expected_type = None
+                    expected_type = expected.get(key)
                     if expected_type is not None and SmartType(value) != expected_type:
                         return f"Invalid type of {key}: {value} (expected {expected_type})"
                 return True
             setattr(cls, "VALIDATE_INPUTS", validate_inputs)
         return cls
     return decorator
-
@@ -0,0 +1,79 @@
+from comfy.graph_utils import GraphBuilder, is_link
+from comfy.graph import DynamicPrompt
+from .catalog import NodeCatalog
+
+UNAVAILABLE_NODE = "unavailable_node"
+UNKNOWN_INPUT = "unknown_input"
+INVALID_LINK = "invalid_link"
+BAD_OUTPUT_INDEX = "bad_output_index"
+TYPE_MISMATCH = "type_mismatch"
+MISSING_INPUT = "missing_input"
+# Raised while executing the generated code rather than found in the graph
+EXEC_ERROR = "exec_error"
+
+class GraphError:
+    def __init__(self, kind, message, node_id=None, class_type=None, input_name=None, lineno=None):
+        self.kind = kind
+        self.message = message
+        self.node_id = node_id
+        self.class_type = class_type
+        self.input_name = input_name
+        self.lineno = lineno
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return repr(self.message)
+
+def get_link_source_class(graph: GraphBuilder, existing_graph: DynamicPrompt, from_id):
+    from_node = graph.nodes.get(from_id, None)
+    if from_node is not None:
+        return from_node.class_type
+    from_node = existing_graph.get_node(from_id)
+    if from_node is not None:
+        return from_node["class_type"]
+    return None
+
+def validate_graph(graph: GraphBuilder, existing_graph: DynamicPrompt, catalog: NodeCatalog) -> list[GraphError]:
+    """
+    Checks a generated graph against the precompiled schema index in a single pass,
+    collecting every error rather than stopping at the first one.
+    """
+    errors = []
+    allowed = catalog.allowed
+    schemas = catalog.schemas
+    return_types = catalog.return_types
+    for node_id, node in graph.nodes.items():
+        class_type = node.class_type
+        if class_type not in allowed:
+            errors.append(GraphError(UNAVAILABLE_NODE, f"Node type '{class_type}' is not available in this environment.", node_id, class_type))
+            continue
+        all_inputs = schemas[class_type].inputs
+        for k, v in node.inputs.items():
+            spec = all_inputs.get(k)
+            if spec is None:
+                errors.append(GraphError(UNKNOWN_INPUT, f"Node type '{class_type}' does not have an input named '{k}'", node_id, class_type, k))
+                continue
+            if not is_link(v):
+                continue
+            input_type = spec[0]
+            from_id, idx = v
+            from_class_type = get_link_source_class(graph, existing_graph, from_id)
+            if from_class_type is None:
+                errors.append(GraphError(INVALID_LINK, f"Node of type '{class_type}' has an input from an invalid node: '{from_id}'", node_id, class_type, k))
+                continue
+            from_outputs = return_types.get(from_class_type)
+            if from_outputs is None:
+                errors.append(GraphError(INVALID_LINK, f"Node of type '{class_type}' has an input from node of type '{from_class_type}' which is not installed.", node_id, class_type, k))
+                continue
+            if idx >= len(from_outputs):
+                errors.append(GraphError(BAD_OUTPUT_INDEX, f"Node of type '{class_type}' is attempting to use output {idx} from node of type '{from_class_type}' which only has {len(from_outputs)} outputs.", node_id, class_type, k))
+                continue
+            from_output = from_outputs[idx]
+            if from_output != input_type:
+                errors.append(GraphError(TYPE_MISMATCH, f"The {k} input of node of type '{class_type}' is expecting type '{input_type}' but got type '{from_output}' from node of type '{from_class_type}'.", node_id, class_type, k))
+        for k, (_, required) in all_inputs.items():
+            if required and k not in node.inputs:
+                errors.append(GraphError(MISSING_INPUT, f"Node of type '{class_type}' is missing a required input '{k}'.", node_id, class_type, k))
+    return errors